@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Compares a loop of add_url_rule with one add_url_rules call.
+
+    PYTHONPATH=. python bench/registration.py [number]
+
+The map is sorted at the end in both cases.
+"""
+import sys
+import timeit
+from flak import Flak
+
+
+def view(cx, id=None):
+    return ''
+
+
+def make_rules(n):
+    return [('/item%d/<int:id>' % i, view, 'item%d' % i) for i in range(n)]
+
+
+def add_one_by_one(rules):
+    app = Flak(__name__)
+    for pattern, func, key in rules:
+        app.add_url_rule(pattern, func, key)
+    app.url_map.update()
+
+
+def add_in_bulk(rules):
+    app = Flak(__name__)
+    app.add_url_rules(rules)
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    print('%8s  %-14s %10s' % ('routes', 'method', 'ms'))
+    for n in 10, 100, 1000, 10000:
+        rules = make_rules(n)
+        for f in add_one_by_one, add_in_bulk:
+            t = min(timeit.repeat(lambda: f(rules), number=1, repeat=number))
+            print('%8d  %-14s %10.2f' % (n, f.__name__, t * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Compares werkzeug's linear Map.match with flak's route matchers.
+
+    PYTHONPATH=. python bench/routing.py [number]
+
+Match caches are disabled so every lookup does the full work.
+"""
+import sys
+import random
+import timeit
+from werkzeug.routing import Map, Rule
+from flak.routing import RouteMatcher, RadixMatcher
+
+
+def make_map(n):
+    rules = []
+    for i in range(n):
+        kind = i % 4
+        if kind == 0:
+            rules.append(Rule('/static%d/page' % i, endpoint='s%d' % i))
+        elif kind == 1:
+            rules.append(Rule('/item%d/<int:id>' % i, endpoint='i%d' % i))
+        elif kind == 2:
+            rules.append(Rule('/user%d/<name>/posts/' % i,
+                              endpoint='u%d' % i))
+        else:
+            rules.append(Rule('/files%d/<path:name>' % i, endpoint='f%d' % i))
+    return Map(rules)
+
+
+def sample_paths(n, count=200):
+    rv = []
+    rnd = random.Random(n)
+    for _ in range(count):
+        i = rnd.randrange(n)
+        kind = i % 4
+        if kind == 0:
+            rv.append('/static%d/page' % i)
+        elif kind == 1:
+            rv.append('/item%d/%d' % (i, rnd.randrange(1000)))
+        elif kind == 2:
+            rv.append('/user%d/bob/posts/' % i)
+        else:
+            rv.append('/files%d/a/b/c.txt' % i)
+    return rv
+
+
+def run(n, number):
+    url_map = make_map(n)
+    adapters = [url_map.bind('localhost', path_info=p)
+                for p in sample_paths(n)]
+    engines = [('werkzeug', lambda a: a.match(return_rule=True))]
+    for cls in RouteMatcher, RadixMatcher:
+        matcher = cls(url_map, 0)
+        matcher.refresh()
+        engines.append((cls.__name__, matcher.match))
+    results = []
+    for name, match in engines:
+        def loop(match=match):
+            for adapter in adapters:
+                match(adapter)
+        t = min(timeit.repeat(loop, number=number, repeat=3))
+        results.append((name, t / (number * len(adapters)) * 1e6))
+    return results
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print('%8s  %-14s %10s' % ('routes', 'engine', 'us/match'))
+    for n in 10, 100, 1000, 10000:
+        for name, usec in run(n, number):
+            print('%8d  %-14s %10.2f' % (n, name, usec))
+
+
+if __name__ == '__main__':
+    main()
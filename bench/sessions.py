@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Compares the cookie size and the encode/decode time of the session
+serializers, measured on the signed cookie value.
+
+    PYTHONPATH=. python bench/sessions.py [number]
+"""
+import sys
+import uuid
+import timeit
+from datetime import datetime
+from flak import Flak
+from flak.sessions import (SecureCookieSessionInterface,
+                           TaggedJsonSerializer, CompactSessionSerializer)
+
+
+def make_cart(n):
+    return {
+        u'_permanent': True,
+        u'user_id': uuid.uuid4(),
+        u'csrf': b'\x8f' * 32,
+        u'last_seen': datetime(2016, 5, 1, 12, 30),
+        u'cart': [{u'sku': u'SKU-%05d' % i, u'qty': i % 5 + 1,
+                   u'price': 9.99, u'added': datetime(2016, 5, 1),
+                   u'options': (u'size-m', u'colour-%d' % (i % 7))}
+                  for i in range(n)],
+    }
+
+
+def run(serializer, data, number):
+    class Interface(SecureCookieSessionInterface):
+        pass
+    Interface.serializer = serializer
+
+    app = Flak(__name__)
+    app.secret_key = 'bench'
+    with app.test_context() as cx:
+        s = Interface().get_signing_serializer(cx)
+        cookie = s.dumps(data)
+        assert s.loads(cookie) == data
+        dump = min(timeit.repeat(lambda: s.dumps(data),
+                                 number=number, repeat=3))
+        load = min(timeit.repeat(lambda: s.loads(cookie),
+                                 number=number, repeat=3))
+    return len(cookie), dump / number * 1e6, load / number * 1e6
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    print('%6s  %-8s %8s %10s %10s' % ('items', 'format', 'bytes',
+                                      'dump us', 'load us'))
+    for n in 0, 5, 20, 60:
+        data = make_cart(n)
+        for name, serializer in (('json', TaggedJsonSerializer),
+                                 ('compact', CompactSessionSerializer)):
+            size, dump, load = run(serializer, data, number)
+            print('%6d  %-8s %8d %10.1f %10.1f' % (n, name, size,
+                                                  dump, load))
+
+
+if __name__ == '__main__':
+    main()
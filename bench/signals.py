@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Measures the signal overhead of a request when nothing is connected.
+
+    PYTHONPATH=. python bench/signals.py [number]
+
+"always send" forces every signal to be sent, which was the behaviour
+before senders checked ``has_receivers``.
+"""
+import sys
+import timeit
+from werkzeug.test import EnvironBuilder
+import flak
+from flak import Flak
+
+signals = (flak.context_created, flak.request_started,
+           flak.request_finished, flak.context_teardown)
+
+
+def make_request(app):
+    environ = EnvironBuilder('/').get_environ()
+
+    def start_response(status, headers):
+        pass
+
+    def request():
+        app(dict(environ), start_response)
+    return request
+
+
+def emit(app):
+    for signal in signals:
+        if signal.has_receivers:
+            signal.send(app, context=None)
+
+
+def measure(app, number):
+    request = make_request(app)
+    return (min(timeit.repeat(request, number=number, repeat=3)),
+            min(timeit.repeat(lambda: emit(app), number=number, repeat=3)))
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    app = Flak(__name__)
+
+    @app.route('/')
+    def index(cx):
+        return 'Hello'
+
+    # alternate the modes to even out warmup and machine noise
+    results = {}
+    try:
+        for _ in range(3):
+            for flag in False, True:
+                for signal in signals:
+                    signal.has_receivers = flag
+                rv = measure(app, number)
+                old = results.get(flag, rv)
+                results[flag] = (min(old[0], rv[0]), min(old[1], rv[1]))
+    finally:
+        for signal in signals:
+            signal.has_receivers = False
+    results = [('receiver check', results[False]),
+               ('always send', results[True])]
+
+    print('%-16s %12s %14s' % ('mode', 'us/request', 'us/4 signals'))
+    for name, (request, signal) in results:
+        print('%-16s %12.2f %14.3f' % (name, request / number * 1e6,
+                                       signal / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Compares the time to sign and verify a session cookie with the
+session signer algorithms.
+
+    PYTHONPATH=. python bench/signers.py [number]
+"""
+import sys
+import hashlib
+import timeit
+from flak import Flak
+from flak.sessions import (SecureCookieSessionInterface,
+                           PrecomputedHMACAlgorithm, Blake2bAlgorithm)
+
+
+def algorithms():
+    yield 'itsdangerous', None
+    yield 'precomputed-sha1', PrecomputedHMACAlgorithm()
+    yield 'precomputed-sha256', PrecomputedHMACAlgorithm(hashlib.sha256)
+    if hasattr(hashlib, 'blake2b'):
+        yield 'blake2b', Blake2bAlgorithm()
+
+
+def run(algorithm, payload, number):
+    class Interface(SecureCookieSessionInterface):
+        signer_algorithm = algorithm
+
+    app = Flak(__name__)
+    app.secret_key = 'bench'
+    with app.test_context() as cx:
+        signer = Interface().get_signing_serializer(cx).make_signer()
+        signed = signer.sign(payload)
+        assert signer.unsign(signed) == payload
+        sign = min(timeit.repeat(lambda: signer.sign(payload),
+                                 number=number, repeat=3))
+        unsign = min(timeit.repeat(lambda: signer.unsign(signed),
+                                   number=number, repeat=3))
+    return sign / number * 1e6, unsign / number * 1e6
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print('%6s  %-20s %10s %10s' % ('bytes', 'algorithm', 'sign us',
+                                    'verify us'))
+    for size in 64, 1024, 4000:
+        payload = b'x' * size
+        for name, algorithm in algorithms():
+            sign, unsign = run(algorithm, payload, number)
+            print('%6d  %-20s %10.2f %10.2f' % (size, name, sign, unsign))
+
+
+if __name__ == '__main__':
+    main()
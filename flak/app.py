@@ -4,7 +4,7 @@ import os
 import sys
 from threading import Lock
 from datetime import timedelta
-from collections import Mapping, deque
+from collections import Mapping
 from functools import update_wrapper
 
 from werkzeug.datastructures import ImmutableDict
@@ -15,19 +15,23 @@ from werkzeug.exceptions import (HTTPException, InternalServerError,
 
 from . import json, cli
 from .helpers import (locked_cached_property, _endpoint_from_view_func,
-                      find_package, get_root_path)
+                      find_package, get_root_path, LRUCache)
 from .wrappers import Request, Response
 from .config import ConfigAttribute, Config
 from .context import RequestContext, AppContext, Bucket
+from .routing import RouteMatcher
 from .sessions import SecureCookieSessionInterface
 from .signals import (context_created, context_teardown,
                       request_started, request_finished, request_exception)
 from ._compat import (string_types, text_type, integer_types,
-                      reraise, iterkeys)
+                      reraise, iterkeys, itervalues)
 
 
 _logger_lock = Lock()
+_freeze_lock = Lock()
 _sentinel = object()
+_error_handler_cache_limit = 1024
+_error_body_cache_limit = 256
 
 
 def _make_timedelta(value):
@@ -37,7 +41,29 @@ def _make_timedelta(value):
 
 
 def setupmethod(f):
-    return f
+    def wrapper(self, *args, **kwargs):
+        if self.frozen:
+            raise AssertionError('A setup function was called after the '
+                                 'application was frozen, which happens when '
+                                 'it handles its first request.  Make sure '
+                                 'all rules and handlers are registered '
+                                 'before the application starts serving.')
+        return f(self, *args, **kwargs)
+    return update_wrapper(wrapper, f)
+
+
+def _overrides(app, name):
+    return (name in app.__dict__
+            or getattr(type(app), name) != getattr(Flak, name))
+
+
+def _has_default_body(e):
+    # the body only depends on code, name and description
+    cls = type(e)
+    return (cls.get_response == HTTPException.get_response
+            and cls.get_body == HTTPException.get_body
+            and cls.get_description == HTTPException.get_description
+            and getattr(e, 'response', None) is None)
 
 
 class Flak(object):
@@ -65,8 +91,10 @@ class Flak(object):
     json_encoder = json.JSONEncoder
     json_decoder = json.JSONDecoder
     url_rule_class = Rule
+    url_matcher_class = RouteMatcher
     test_client_class = None
     session_interface = SecureCookieSessionInterface()
+    frozen = False
 
     debug = ConfigAttribute('DEBUG')
     testing = ConfigAttribute('TESTING')
@@ -83,6 +111,7 @@ class Flak(object):
         'PROPAGATE_EXCEPTIONS':                 None,
         'PRESERVE_CONTEXT_ON_EXCEPTION':        None,
         'SECRET_KEY':                           None,
+        'SECRET_KEY_FALLBACKS':                 (),
         'PERMANENT_SESSION_LIFETIME':           timedelta(days=31),
         'USE_X_SENDFILE':                       False,
         'LOGGER_NAME':                          None,
@@ -95,14 +124,19 @@ class Flak(object):
         'SESSION_COOKIE_HTTPONLY':              True,
         'SESSION_COOKIE_SECURE':                False,
         'SESSION_REFRESH_EACH_REQUEST':         True,
+        'SESSION_REFRESH_FRACTION':             None,
+        'SESSION_COOKIE_CACHE_SIZE':            0,
         'MAX_CONTENT_LENGTH':                   None,
         'SEND_FILE_MAX_AGE_DEFAULT':            12 * 60 * 60,  # 12 hours
         'TRAP_BAD_REQUEST_ERRORS':              False,
         'TRAP_HTTP_EXCEPTIONS':                 False,
         'PREFERRED_URL_SCHEME':                 'http',
+        'JSON_BACKEND':                         None,
         'JSON_AS_ASCII':                        True,
         'JSON_SORT_KEYS':                       True,
         'JSONIFY_PRETTYPRINT_REGULAR':          True,
+        'URL_MATCH_CACHE_SIZE':                 1024,
+        'URL_BUILD_CACHE_SIZE':                 0,
     })
 
     def __init__(self, import_name,
@@ -125,9 +159,17 @@ class Flak(object):
         self.instance_path = instance_path
         self._logger = None
         self.logger_name = self.import_name
+        self.json_backends = dict(json.backends)
+        self.json_types = json.JSONTypes(json.default_types.serializers)
+        self._json_backend = None
+        self._json_codecs = None
         self.url_map = Map()
+        self._url_adapters = {}
         self.endpoints = {}
+        self.head_handlers = {}
         self.error_handlers = {}
+        self._error_handler_cache = {}
+        self._error_bodies = {}
         self.url_build_error_handlers = []
         self.before_request_funcs = []
         self.after_request_funcs = []
@@ -135,6 +177,8 @@ class Flak(object):
         self.url_value_preprocessors = []
         self.url_default_functions = []
         self.shell_context_processors = []
+        self._dispatch = None
+        self._teardown_chain = None
 
     @locked_cached_property
     def name(self):
@@ -145,6 +189,17 @@ class Flak(object):
             return os.path.splitext(os.path.basename(fn))[0]
         return self.import_name
 
+    @locked_cached_property
+    def url_matcher(self):
+        return self.url_matcher_class(self.url_map,
+                                      self.config['URL_MATCH_CACHE_SIZE'])
+
+    @locked_cached_property
+    def url_build_cache(self):
+        size = self.config['URL_BUILD_CACHE_SIZE']
+        if size:
+            return LRUCache(size)
+
     @property
     def propagate_exceptions(self):
         rv = self.config['PROPAGATE_EXCEPTIONS']
@@ -152,6 +207,23 @@ class Flak(object):
             return rv
         return self.testing or self.debug
 
+    @property
+    def json_backend(self):
+        name = self.config['JSON_BACKEND']
+        cached = self._json_backend
+        if cached is not None and cached[0] == name:
+            return cached[1]
+        if name is None:
+            rv = json.default_backend
+        else:
+            try:
+                factory = self.json_backends[name]
+            except KeyError:
+                raise LookupError('Unknown JSON backend %r' % (name,))
+            rv = factory()
+        self._json_backend = (name, rv)
+        return rv
+
     @property
     def logger(self):
         if self._logger and self._logger.name == self.logger_name:
@@ -214,6 +286,59 @@ class Flak(object):
 
     @setupmethod
     def add_url_rule(self, pattern, func, key=None, **options):
+        rule = self._make_url_rule(pattern, func, key, options)
+        self.url_map.add(rule)
+        if func is not None:
+            self._check_endpoint(rule.endpoint, func, self.endpoints)
+            self.endpoints[rule.endpoint] = func
+
+    @setupmethod
+    def add_url_rules(self, rules):
+        """Registers many rules at once.  Each item is a tuple of
+        ``(pattern, func[, key[, options]])`` with the same meaning as the
+        arguments of :meth:`add_url_rule`.  Either all rules are added or,
+        if one of them is invalid, none, and the map is sorted once at the
+        end.
+        """
+        new_rules = []
+        new_endpoints = {}
+        for item in rules:
+            pattern, func = item[:2]
+            key = len(item) > 2 and item[2] or None
+            options = len(item) > 3 and dict(item[3]) or {}
+            rule = self._make_url_rule(pattern, func, key, options)
+            if func is not None:
+                self._check_endpoint(rule.endpoint, func,
+                                     new_endpoints, self.endpoints)
+                new_endpoints[rule.endpoint] = func
+            new_rules.append(rule)
+        # patterns are only compiled when bound, take the added rules out
+        # again if one of them fails
+        url_map = self.url_map
+        count = len(url_map._rules)
+        try:
+            for rule in new_rules:
+                url_map.add(rule)
+        except Exception:
+            for rule in reversed(url_map._rules[count:]):
+                by_endpoint = url_map._rules_by_endpoint[rule.endpoint]
+                by_endpoint.pop()
+                if not by_endpoint:
+                    del url_map._rules_by_endpoint[rule.endpoint]
+            del url_map._rules[count:]
+            raise
+        self.endpoints.update(new_endpoints)
+        url_map.update()
+
+    @staticmethod
+    def _check_endpoint(key, func, *endpoint_maps):
+        for endpoints in endpoint_maps:
+            orig = endpoints.get(key)
+            if orig is not None and orig != func:
+                raise AssertionError('View function mapping is overwriting an '
+                                     'existing endpoint function: %s' % key)
+
+    def _make_url_rule(self, pattern, func, key, options):
         if key is None:
             key = _endpoint_from_view_func(func)
         options['endpoint'] = key
@@ -245,14 +370,7 @@ class Flak(object):
 
         rule = self.url_rule_class(pattern, methods=methods, **options)
         rule.provide_automatic_options = provide_automatic_options
-
-        self.url_map.add(rule)
-        if func is not None:
-            orig = self.endpoints.get(key)
-            if orig is not None and orig != func:
-                raise AssertionError('View function mapping is overwriting an '
-                                     'existing endpoint function: %s' % key)
-            self.endpoints[key] = func
+        return rule
 
     def route(self, rule, **options):
         def decorator(f):
@@ -268,6 +386,38 @@ class Flak(object):
             return f
         return decorator
 
+    @setupmethod
+    def head_handler(self, key):
+        """Registers a function that answers ``HEAD`` requests for the
+        endpoint `key` instead of its view, for views whose body is
+        expensive to produce but whose headers are not::
+
+            @app.head_handler('download')
+            def download_head(cx, name):
+                return '', {'Content-Length': str(size_of(name))}
+        """
+        def decorator(f):
+            self.head_handlers[key] = f
+            return f
+        return decorator
+
+    @setupmethod
+    def json_serializer(self, cls):
+        """Registers a function that turns instances of `cls` and its
+        subclasses into something JSON can serialize.  It is used by
+        ``jsonify``, ``dumps`` and the session serializers::
+
+            @app.json_serializer(decimal.Decimal)
+            def serialize_decimal(o):
+                return str(o)
+        """
+        def decorator(f):
+            self.json_types.register(cls, f)
+            # encoders are configured by what is registered
+            self._json_codecs = None
+            return f
+        return decorator
+
     @staticmethod
     def _get_exc_class_and_code(exc_class_or_code):
         if isinstance(exc_class_or_code, integer_types):
@@ -294,6 +444,7 @@ class Flak(object):
         exc_class, code = self._get_exc_class_and_code(code_or_exception)
         handlers = self.error_handlers.setdefault(code, {})
         handlers[exc_class] = f
+        self._rebuild_error_handler_cache()
 
     @setupmethod
     def before_request(self, f):
@@ -326,26 +477,37 @@ class Flak(object):
         return f
 
     def _find_error_handler(self, e):
-        exc_class, code = self._get_exc_class_and_code(type(e))
+        return self._error_handler_for(type(e))
 
-        def find_handler(handler_map):
-            if not handler_map:
-                return
-            q = deque(exc_class.__mro__)
-            done = set()
-            while q:
-                cls = q.popleft()
-                if cls in done:
-                    continue
-                done.add(cls)
+    def _error_handler_for(self, exc_class):
+        # resolved handlers are kept per exception class.  Lookups from
+        # request threads only ever add to the dict, registration swaps in
+        # a new one, so no locking is needed
+        cache = self._error_handler_cache
+        try:
+            return cache[exc_class]
+        except KeyError:
+            pass
+        handler = self._resolve_error_handler(exc_class)
+        if len(cache) < _error_handler_cache_limit:
+            cache[exc_class] = handler
+        return handler
+
+    def _resolve_error_handler(self, exc_class):
+        code = self._get_exc_class_and_code(exc_class)[1]
+        handler_map = self.error_handlers.get(code)
+        if handler_map:
+            for cls in exc_class.__mro__:
                 handler = handler_map.get(cls)
                 if handler is not None:
-                    # cache for next time exc_class is raised
-                    handler_map[exc_class] = handler
                     return handler
-                q.extend(cls.__mro__)
 
-        return find_handler(self.error_handlers.get(code))
+    def _rebuild_error_handler_cache(self):
+        classes = set(itervalues(default_exceptions))
+        for handler_map in itervalues(self.error_handlers):
+            classes.update(handler_map)
+        self._error_handler_cache = dict(
+            (cls, self._resolve_error_handler(cls)) for cls in classes)
 
     def handle_http_exception(self, cx, e):
         if e.code is None:
@@ -355,6 +517,33 @@ class Flak(object):
             return e
         return handler(cx, e)
 
+    def default_error_response(self, cx, e):
+        """Werkzeug's error page for `e` as a response object.  The
+        rendered body is cached per code and hashable description.
+        """
+        environ = cx.request.environ if cx.request is not None else None
+        if not _has_default_body(e):
+            return e.get_response(environ)
+        key = (e.code, e.name, e.description)
+        try:
+            body = self._error_bodies.get(key)
+        except TypeError:
+            return e.get_response(environ)
+        if body is None:
+            body = e.get_body(environ).encode(self.response_class.charset)
+            if len(self._error_bodies) < _error_body_cache_limit:
+                self._error_bodies[key] = body
+        return self.response_class(body, e.code, e.get_headers(environ))
+
+    def make_error_response(self, cx, e):
+        """Turns the HTTP exception `e` into a response without raising
+        it, going through the registered error handlers.  Trapped
+        exceptions are still raised.
+        """
+        if self.trap_http_exception(e):
+            raise e
+        return self.make_response(cx, self.handle_http_exception(cx, e))
+
     def trap_http_exception(self, e):
         if self.config['TRAP_HTTP_EXCEPTIONS']:
             return True
@@ -378,8 +567,9 @@ class Flak(object):
 
     def handle_exception(self, cx, e):
         exc_type, exc_value, tb = sys.exc_info()
-        request_exception.send(self, context=cx, exception=e)
-        handler = self._find_error_handler(InternalServerError())
+        if request_exception.has_receivers:
+            request_exception.send(self, context=cx, exception=e)
+        handler = self._error_handler_for(InternalServerError)
 
         if self.propagate_exceptions:
             if exc_value is e:
@@ -406,9 +596,21 @@ class Flak(object):
         from .debughelpers import FormDataRoutingRedirect
         raise FormDataRoutingRedirect(rq)
 
+    def _can_skip_raise(self, rq):
+        # a routing exception only needs to be raised when something could
+        # look at it as the current exception: a handler reading
+        # sys.exc_info(), trapping or overridden exception handling
+        e = rq.routing_exception
+        return (not self.debug
+                and self._error_handler_for(type(e)) is None
+                and not self.trap_http_exception(e)
+                and not _overrides(self, 'handle_user_exception')
+                and not _overrides(self, 'handle_http_exception')
+                and not _overrides(self, 'raise_routing_exception'))
+
     def make_default_options_response(self, cx):
         rv = self.response_class()
-        rv.allow.update(cx.url_adapter.allowed_methods())
+        rv.allow.update(self.url_matcher.allowed_methods(cx.url_adapter))
         return rv
 
     def should_ignore_error(self, cx, error):
@@ -420,6 +622,8 @@ class Flak(object):
         response_class          returned unchanged
         text                    a response object is created with the
                                 string as body (unicode as utf-8)
+        HTTPException           the default error page, see
+                                :meth:`default_error_response`
         function                called as WSGI application
                                 and buffered as response object
         tuple                   (response, status, headers), or
@@ -448,6 +652,8 @@ class Flak(object):
                 rv = self.response_class(rv, headers=headers,
                                          status=status_or_headers)
                 headers = status_or_headers = None
+            elif isinstance(rv, HTTPException) and rv.code is not None:
+                rv = self.default_error_response(cx, rv)
             else:
                 rv = self.response_class.force_type(rv, cx.request.environ)
 
@@ -469,9 +675,15 @@ class Flak(object):
         if server_name is not None:
             script_name = self.config['APPLICATION_ROOT'] or '/'
             url_scheme = self.config['PREFERRED_URL_SCHEME']
-            return self.url_map.bind(server_name,
-                                     script_name=script_name,
-                                     url_scheme=url_scheme)
+            # request independent adapters only depend on config and
+            # are never mutated, so they can be shared between contexts
+            key = (server_name, script_name, url_scheme)
+            rv = self._url_adapters.get(key)
+            if rv is None:
+                rv = self._url_adapters[key] = self.url_map.bind(
+                    server_name, script_name=script_name,
+                    url_scheme=url_scheme)
+            return rv
 
     def inject_url_defaults(self, cx, endpoint, values):
         for f in self.url_default_functions:
@@ -495,6 +707,65 @@ class Flak(object):
             reraise(exc_type, exc_value, tb)
         raise error
 
+    def freeze(self):
+        """Ends the setup phase.  The hook lists become tuples, the
+        request pipeline is compiled once and setup methods raise from
+        now on.  Called automatically on the first request.
+        """
+        with _freeze_lock:
+            if self.frozen:
+                return
+            self.before_request_funcs = tuple(self.before_request_funcs)
+            self.after_request_funcs = tuple(self.after_request_funcs)
+            self.teardown_funcs = tuple(self.teardown_funcs)
+            self.url_value_preprocessors = tuple(self.url_value_preprocessors)
+            self.url_default_functions = tuple(self.url_default_functions)
+            self._teardown_chain = tuple(reversed(self.teardown_funcs))
+            self.url_map.update()
+            self._dispatch = self._compile_dispatch()
+            self.frozen = True
+
+    def _compile_dispatch(self):
+        app = self
+        dispatch_request = self.dispatch_request
+        handle_user_exception = self.handle_user_exception
+        make_response = self.make_response
+
+        preprocess_request = self.preprocess_request
+        if not (self.url_value_preprocessors or self.before_request_funcs
+                or _overrides(self, 'preprocess_request')):
+            preprocess_request = None
+
+        process_response = self.process_response
+        if not _overrides(self, 'process_response'):
+            after_request = tuple(reversed(self.after_request_funcs))
+            save_session = self.save_session
+
+            def process_response(cx, response):
+                cx.process_response(response)
+                for f in after_request:
+                    response = f(cx, response)
+                save_session(cx, response)
+                return response
+
+        def full_dispatch_request(cx):
+            try:
+                if request_started.has_receivers:
+                    request_started.send(app, context=cx)
+                rv = None
+                if preprocess_request is not None:
+                    rv = preprocess_request(cx)
+                if rv is None:
+                    rv = dispatch_request(cx)
+            except Exception as e:
+                rv = handle_user_exception(cx, e)
+            rsp = process_response(cx, make_response(cx, rv))
+            if request_finished.has_receivers:
+                request_finished.send(app, context=cx, response=rsp)
+            return rsp
+
+        return full_dispatch_request
+
     def preprocess_request(self, cx):
         rq = cx.request
         for f in self.url_value_preprocessors:
@@ -516,9 +787,13 @@ class Flak(object):
     def do_teardown(self, cx, exc=_sentinel):
         if exc is _sentinel:
             exc = sys.exc_info()[1]
-        for f in reversed(self.teardown_funcs):
+        funcs = self._teardown_chain
+        if funcs is None:
+            funcs = reversed(self.teardown_funcs)
+        for f in funcs:
             f(cx, exc)
-        context_teardown.send(self, context=cx, exception=exc)
+        if context_teardown.has_receivers:
+            context_teardown.send(self, context=cx, exception=exc)
 
     def build_request(self, environ):
         rq = self.request_class(environ)
@@ -531,7 +806,8 @@ class Flak(object):
             cx = AppContext(self)
         else:
             cx = RequestContext(self, rq)
-        context_created.send(self, context=cx)
+        if context_created.has_receivers:
+            context_created.send(self, context=cx)
         return cx
 
     def test_context(self, *args, **kwargs):
@@ -544,6 +820,8 @@ class Flak(object):
             builder.close()
 
     def wsgi_app(self, environ, start_response):
+        if not self.frozen:
+            self.freeze()
         rq = self.build_request(environ)
         cx = self.new_context(rq)
         error = None
@@ -560,8 +838,11 @@ class Flak(object):
             cx.close(error)
 
     def full_dispatch_request(self, cx):
+        if self._dispatch is not None:
+            return self._dispatch(cx)
         try:
-            request_started.send(self, context=cx)
+            if request_started.has_receivers:
+                request_started.send(self, context=cx)
             rv = self.preprocess_request(cx)
             if rv is None:
                 rv = self.dispatch_request(cx)
@@ -569,17 +850,24 @@ class Flak(object):
             rv = self.handle_user_exception(cx, e)
         rsp = self.make_response(cx, rv)
         rsp = self.process_response(cx, rsp)
-        request_finished.send(self, context=cx, response=rsp)
+        if request_finished.has_receivers:
+            request_finished.send(self, context=cx, response=rsp)
         return rsp
 
     def dispatch_request(self, cx):
         rq = cx.request
         if rq.routing_exception is not None:
+            if self._can_skip_raise(rq):
+                return self.default_error_response(cx, rq.routing_exception)
             self.raise_routing_exception(rq)
         auto_options = getattr(rq.url_rule, 'provide_automatic_options', False)
         if (auto_options and rq.method == 'OPTIONS'):
             return self.make_default_options_response(cx)
-        f = self.endpoints[rq.url_rule.endpoint]
+        f = None
+        if self.head_handlers and rq.method == 'HEAD':
+            f = self.head_handlers.get(rq.url_rule.endpoint)
+        if f is None:
+            f = self.endpoints[rq.url_rule.endpoint]
         return f(cx, **rq.view_args)
 
     __call__ = wsgi_app
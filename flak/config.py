@@ -27,11 +27,45 @@ class ConfigAttribute(object):
 
 
 class Config(dict):
+    #: incremented on every change, lets derived values be cached until
+    #: the config changes.  Changes inside mutable values aren't seen
+    generation = 0
 
     def __init__(self, root_path, defaults=None):
         dict.__init__(self, defaults or {})
         self.root_path = root_path
 
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self.generation += 1
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.generation += 1
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self.generation += 1
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    def pop(self, *args):
+        rv = dict.pop(self, *args)
+        self.generation += 1
+        return rv
+
+    def popitem(self):
+        rv = dict.popitem(self)
+        self.generation += 1
+        return rv
+
+    def clear(self):
+        dict.clear(self)
+        self.generation += 1
+
     def __repr__(self):
         return '<%s %s>' % (self.__class__.__name__, dict.__repr__(self))
 
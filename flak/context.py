@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 
 import sys
-from werkzeug.exceptions import HTTPException
+from werkzeug.exceptions import HTTPException, default_exceptions
+from werkzeug.utils import cached_property
 from .helpers import _url_for
 from flak import json
 
@@ -56,25 +57,23 @@ class AppContext(object):
             self._before_close_funcs.append(f)
         return decorator
 
-    @property
+    @cached_property
     def url_adapter(self):
         return self.app.create_url_adapter(self)
 
     def dumps(__self, *__args, **__kw):
-        json.dump_defaults(__self.app, __kw)
-        return json._dumps(*__args, **__kw)
+        return json._app_dumps(__self.app, *__args, **__kw)
 
     def dump(__self, *__args, **__kw):
         json.dump_defaults(__self.app, __kw)
-        return json._dump(*__args, **__kw)
+        return __self.app.json_backend.dump(*__args, **__kw)
 
     def loads(__self, *__args, **__kw):
-        json.load_defaults(__self.app, __kw)
-        return json._loads(*__args, **__kw)
+        return json._app_loads(__self.app, *__args, **__kw)
 
     def load(__self, *__args, **__kw):
         json.load_defaults(__self.app, __kw)
-        return json._load(*__args, **__kw)
+        return __self.app.json_backend.load(*__args, **__kw)
 
     def url_for(__self, __x, **__values):
         return _url_for(__self, __x, __values)
@@ -86,9 +85,7 @@ class RequestContext(AppContext):
         self.request = rq
         AppContext.__init__(self, app)
         self.match_request()
-        self.session = self.app.open_session(self)
         self._after_request_funcs = []
-        assert self.session is not None
 
     def __repr__(self):
         f = '<%s \'%s\' [%s] of %s>'
@@ -97,6 +94,18 @@ class RequestContext(AppContext):
                     self.request.method,
                     self.app.name)
 
+    @cached_property
+    def session(self):
+        # opened on first access, views that never touch the session
+        # don't pay for reading and verifying the cookie
+        rv = self.app.open_session(self)
+        assert rv is not None
+        return rv
+
+    @property
+    def session_opened(self):
+        return 'session' in self.__dict__
+
     @property
     def after_request(self):
         def decorator(f):
@@ -115,7 +124,7 @@ class RequestContext(AppContext):
         adapter = self.url_adapter
         rq = self.request
         try:
-            rq.url_rule, rq.view_args = adapter.match(return_rule=True)
+            rq.url_rule, rq.view_args = self.app.url_matcher.match(adapter)
         except HTTPException as e:
             self.request.routing_exception = e
 
@@ -130,6 +139,9 @@ class RequestContext(AppContext):
     def jsonify(__self, *args, **kw):
         return json.jsonify(__self, *args, **kw)
 
+    def jsonify_stream(__self, items, pairs=False, chunk_size=None):
+        return json.jsonify_stream(__self, items, pairs, chunk_size)
+
     def make_response(self, *args):
         if not args:
             return self.app.response_class()
@@ -137,9 +149,30 @@ class RequestContext(AppContext):
             args = args[0]
         return self.app.make_response(self, args)
 
+    def abort(self, code, *args, **kw):
+        """Like :func:`werkzeug.exceptions.abort` but returns the error
+        response instead of raising, so views can ``return cx.abort(404)``.
+        """
+        try:
+            exc_class = default_exceptions[code]
+        except KeyError:
+            raise LookupError('no exception for %r' % code)
+        return self.app.make_error_response(self, exc_class(*args, **kw))
+
     def get_json(self, *args, **kw):
         return self.request._get_json(self, *args, **kw)
 
+    def iter_json_lines(self, chunk_size=None):
+        """Parses a newline delimited JSON request body one line at a
+        time while it is read in chunks of `chunk_size` bytes.  Blank
+        lines are skipped, bodies over ``MAX_CONTENT_LENGTH`` raise
+        :exc:`~werkzeug.exceptions.RequestEntityTooLarge`.
+        """
+        return self.request._iter_json_lines(self, chunk_size)
+
+    def ndjson_response(self, items, chunk_size=None):
+        return json.ndjson_response(self, items, chunk_size)
+
     def streaming(self, f):
         def call(*args, **kw):
             return self.close_with_generator(f(*args, **kw))
@@ -153,16 +186,39 @@ class RequestContext(AppContext):
         return closer(gen, close)
 
 
-def closer(gen, close):
-    error = None
-    try:
-        for x in gen:
-            yield x
-    except Exception as e:
-        error = e
-    finally:
-        if hasattr(gen, 'close'):
-            gen.close()
-        close(error)
+class closer(object):
+    """Iterates `gen` and calls `close` when it is exhausted, fails or is
+    closed by the server.  Unlike a generator's ``finally`` clause this
+    also runs when iteration never started, as for ``HEAD`` requests.
+    """
+
+    def __init__(self, gen, close):
+        self._gen = gen
+        self._close = close
+        self._closed = False
 
+    def __iter__(self):
+        return self
 
+    def __next__(self):
+        if self._closed:
+            raise StopIteration()
+        try:
+            return next(self._gen)
+        except StopIteration:
+            self.close()
+        except Exception as e:
+            self.close(e)
+        raise StopIteration()
+
+    next = __next__
+
+    def close(self, error=None):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if hasattr(self._gen, 'close'):
+                self._gen.close()
+        finally:
+            self._close(error)
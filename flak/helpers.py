@@ -4,9 +4,10 @@ import sys
 import pkgutil
 import posixpath
 import mimetypes
+from copy import copy
 from time import time
 from zlib import adler32
-from threading import RLock
+from threading import Lock, RLock
 from werkzeug.routing import BuildError
 from functools import update_wrapper
 
@@ -15,7 +16,7 @@ from werkzeug.datastructures import Headers
 from werkzeug.exceptions import NotFound
 from werkzeug.wsgi import wrap_file
 
-from ._compat import string_types, text_type
+from ._compat import string_types, text_type, iteritems
 
 
 _sentinel = object()
@@ -111,6 +112,89 @@ class locked_cached_property(object):
             return value
 
 
+class LRUCache(object):
+    """A small thread-safe mapping that keeps at most `maxsize` of the
+    most recently used entries.  A `maxsize` of 0 disables storage but
+    still counts misses.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        self._lock = Lock()
+        self._data = {}
+        # circular doubly linked list of [prev, next, key, value] links,
+        # oldest entry first
+        self._root = root = []
+        root[:] = [root, root, None, None]
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return total and float(self.hits) / total or 0.0
+
+    def _unlink(self, link):
+        prev, next = link[0], link[1]
+        prev[1] = next
+        next[0] = prev
+
+    def _append(self, link):
+        root = self._root
+        last = root[0]
+        last[1] = root[0] = link
+        link[0] = last
+        link[1] = root
+
+    def get(self, key, default=None):
+        with self._lock:
+            link = self._data.get(key)
+            if link is None:
+                self.misses += 1
+                return default
+            self._unlink(link)
+            self._append(link)
+            self.hits += 1
+            return link[3]
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            link = self._data.get(key)
+            if link is not None:
+                self._unlink(link)
+                link[3] = value
+            else:
+                if len(self._data) >= self.maxsize:
+                    oldest = self._root[1]
+                    self._unlink(oldest)
+                    del self._data[oldest[2]]
+                link = [None, None, key, value]
+                self._data[key] = link
+            self._append(link)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            link = self._data.pop(key, None)
+            if link is None:
+                return default
+            self._unlink(link)
+            return link[3]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            root = self._root
+            root[:] = [root, root, None, None]
+            self.hits = self.misses = 0
+
+
 def get_root_path(import_name):
     # Module already imported and has a file attribute.  Use that first.
     mod = sys.modules.get(import_name)
@@ -152,6 +236,30 @@ def get_root_path(import_name):
     return os.path.dirname(os.path.abspath(filepath))
 
 
+def _has_pure_url_defaults(app):
+    for f in app.url_default_functions:
+        if not getattr(f, 'pure', False):
+            return False
+    return True
+
+
+def _url_build_key(app, adapter, endpoint, values, method, external, scheme):
+    # 1, 1.0 and True are equal but build different urls, and the query
+    # string follows argument order unless the map sorts it
+    values = tuple((k, type(v), v) for k, v in iteritems(values))
+    url_map = app.url_map
+    if url_map.sort_parameters and url_map.sort_key is None:
+        values = tuple(sorted(values, key=lambda item: item[0]))
+    key = (endpoint, values, method, external, scheme,
+           adapter.server_name, adapter.subdomain, adapter.script_name,
+           adapter.url_scheme, len(app.url_map._rules))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
 def _url_for(cx, endpoint, values):
     url_adapter = cx.url_adapter
     app = cx.app
@@ -170,11 +278,26 @@ def _url_for(cx, endpoint, values):
     anchor = values.pop('_anchor', None)
     method = values.pop('_method', None)
     scheme = values.pop('_scheme', None)
+
+    # url defaults functions may depend on the context, so only cache
+    # when all of them are declared pure (depending on endpoint and
+    # values alone)
+    cache = app.url_build_cache
+    key = None
+    if cache is not None and _has_pure_url_defaults(app):
+        key = _url_build_key(app, url_adapter, endpoint, values,
+                             method, external, scheme)
+        rv = key is not None and cache.get(key)
+        if rv:
+            return _add_anchor(rv, anchor)
+
     app.inject_url_defaults(cx, endpoint, values)
 
     if scheme is not None:
         if not external:
             raise ValueError('When specifying _scheme, _external must be True')
+        # the adapter is shared by the context, don't change it in place
+        url_adapter = copy(url_adapter)
         url_adapter.url_scheme = scheme
 
     try:
@@ -187,8 +310,12 @@ def _url_for(cx, endpoint, values):
         values['_method'] = method
         return app.handle_url_build_error(cx, error, endpoint, values)
 
-    if anchor is not None:
-        rv += '#' + url_quote(anchor)
-    return rv
+    if key is not None:
+        cache.set(key, rv)
+    return _add_anchor(rv, anchor)
 
 
+def _add_anchor(url, anchor):
+    if anchor is not None:
+        url += '#' + url_quote(anchor)
+    return url
@@ -1,21 +1,83 @@
 # -*- coding: utf-8 -*-
+from __future__ import absolute_import
 
 import io
+import re
 import uuid
+import decimal
 import datetime
 from werkzeug.http import http_date
 from itsdangerous import json as _json
-from ._compat import text_type, PY2
+from ._compat import (text_type, string_types, integer_types, iteritems,
+                      PY2)
+
+_missing = object()
+
+# instances of these are written by the json modules themselves and never
+# reach a default hook
+_native_types = string_types + integer_types + (float, list, tuple, dict)
+
+def _html(o):
+    return text_type(o.__html__())
+
+
+class JSONTypes(object):
+    """Maps types to functions that turn their instances into something
+    JSON serializable.  Lookups are by exact type, subclasses are
+    resolved along their MRO once and then cached.  Subclasses of the
+    types JSON writes natively, like namedtuples or ``IntEnum``, can't be
+    registered.
+    """
+
+    def __init__(self, serializers=None):
+        self.serializers = dict(serializers or ())
+        self._resolved = {}
+
+    def register(self, cls, f):
+        if issubclass(cls, _native_types):
+            raise TypeError('%r instances are written by the json module '
+                            'itself, a serializer would never be used' % cls)
+        self.serializers[cls] = f
+        self._resolved = {}
+
+    def resolve(self, cls):
+        """Returns the serializer for instances of `cls` or `None`."""
+        rv = self._resolved.get(cls, _missing)
+        if rv is _missing:
+            for base in getattr(cls, '__mro__', (cls,)):
+                rv = self.serializers.get(base)
+                if rv is not None:
+                    break
+            else:
+                if hasattr(cls, '__html__'):
+                    rv = _html
+            self._resolved[cls] = rv
+        return rv
+
+
+#: the serializers every app starts with
+default_types = JSONTypes({
+    datetime.date: lambda o: http_date(o.timetuple()),
+    uuid.UUID: str,
+})
 
 
 class JSONEncoder(_json.JSONEncoder):
+    #: a :class:`JSONTypes`, apps pass their own with the `types` argument
+    types = default_types
+
+    def __init__(self, *args, **kwargs):
+        types = kwargs.pop('types', None)
+        _json.JSONEncoder.__init__(self, *args, **kwargs)
+        if types is not None:
+            self.types = types
+
     def default(self, o):
-        if isinstance(o, datetime.date):
-            return http_date(o.timetuple())
-        if isinstance(o, uuid.UUID):
-            return str(o)
+        f = self.types.resolve(type(o))
+        if f is not None:
+            return f(o)
         if hasattr(o, '__html__'):
-            return text_type(o.__html__())
+            return _html(o)
         return _json.JSONEncoder.default(self, o)
 
 
@@ -25,26 +87,137 @@ class JSONDecoder(_json.JSONDecoder):
 
 def jsonify(__cx, *__args, **__kw):
     app = __cx.app
-    rq = __cx.request
-    pretty = (app.config['JSONIFY_PRETTYPRINT_REGULAR']
-              and not rq.is_xhr)
+    pretty = _codecs(app).pretty and not __cx.request.is_xhr
     # For security reasons only objects are supported toplevel
-    indent = None
-    separators = (',', ':')
     if pretty:
-        indent = 2
-        separators = (', ', ': ')
-    json = __cx.dumps(dict(*__args, **__kw),
-                      indent=indent,
-                      separators=separators)
+        backend, encoder = get_encoder(app, indent=2,
+                                       separators=(', ', ': '))
+    else:
+        backend, encoder = get_encoder(app, indent=None,
+                                       separators=(',', ':'))
+    json = backend.encodeb(encoder, dict(*__args, **__kw))
     # add '\n' to end of response
     # see https://github.com/mitsuhiko/flak/pull/1262
-    return app.response_class((json, '\n'),
+    return app.response_class((json, b'\n'),
                               mimetype='application/json')
 
+#: responses made by :func:`jsonify_stream` are written in pieces of
+#: about this many bytes
+stream_chunk_size = 16 * 1024
+#: array items are encoded this many at a time, one call per item would
+#: cost more than the encoding for small items
+stream_batch_size = 64
+
+def _stream_pieces(backend, encoder, items, pairs):
+    if backend.bytes_output:
+        encode = backend.encodeb
+        start, sep, colon, end = (b'{', b',', b':', b'}\n') if pairs else \
+            (b'[', b',', None, b']\n')
+    else:
+        encode = backend.encode
+        start, sep, colon, end = (u'{', u',', u':', u'}\n') if pairs else \
+            (u'[', u',', None, u']\n')
+    yield start
+    it = iter(items)
+    try:
+        first = True
+        if pairs:
+            for key, value in it:
+                if not isinstance(key, string_types):
+                    raise TypeError('keys must be strings, not %r' % (key,))
+                if not first:
+                    yield sep
+                first = False
+                yield encode(encoder, key)
+                yield colon
+                yield encode(encoder, value)
+        else:
+            batch = []
+            for item in it:
+                batch.append(item)
+                if len(batch) < stream_batch_size:
+                    continue
+                if not first:
+                    yield sep
+                first = False
+                # the compact list without its brackets
+                yield encode(encoder, batch)[1:-1]
+                batch = []
+            if batch:
+                if not first:
+                    yield sep
+                yield encode(encoder, batch)[1:-1]
+    finally:
+        close = getattr(it, 'close', None)
+        if close is not None:
+            close()
+    yield end
+
+def _ndjson_pieces(backend, encoder, items):
+    if backend.bytes_output:
+        encode, newline = backend.encodeb, b'\n'
+    else:
+        encode, newline = backend.encode, u'\n'
+    it = iter(items)
+    try:
+        for item in it:
+            yield encode(encoder, item)
+            yield newline
+    finally:
+        close = getattr(it, 'close', None)
+        if close is not None:
+            close()
+
+def _coalesce(pieces, chunk_size):
+    buf = []
+    size = 0
+    for piece in pieces:
+        buf.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield _join(buf)
+            buf = []
+            size = 0
+    if buf:
+        yield _join(buf)
+
+def _join(buf):
+    if isinstance(buf[0], bytes):
+        return b''.join(buf)
+    return u''.join(buf).encode('utf-8')
+
+def jsonify_stream(__cx, items, pairs=False, chunk_size=None):
+    """Streams a JSON array of `items` or, with `pairs`, an object of
+    the ``(key, value)`` pairs or mapping `items`.  Items are encoded a
+    few at a time, so memory use is independent of the length of
+    `items`, which is consumed while the response is sent.  The context
+    stays open until then.  Output is always compact.
+    """
+    app = __cx.app
+    backend, encoder = get_encoder(app, indent=None, separators=(',', ':'))
+    if pairs and hasattr(items, 'keys'):
+        items = iteritems(items)
+    pieces = _stream_pieces(backend, encoder, items, pairs)
+    chunks = _coalesce(pieces, chunk_size or stream_chunk_size)
+    return app.response_class(__cx.close_with_generator(chunks),
+                              mimetype='application/json')
+
+def ndjson_response(__cx, items, chunk_size=None):
+    """Streams `items` as newline delimited JSON, one compact record per
+    line, the same way :func:`jsonify_stream` streams an array.
+    """
+    app = __cx.app
+    backend, encoder = get_encoder(app, indent=None, separators=(',', ':'))
+    pieces = _ndjson_pieces(backend, encoder, items)
+    chunks = _coalesce(pieces, chunk_size or stream_chunk_size)
+    return app.response_class(__cx.close_with_generator(chunks),
+                              mimetype='application/x-ndjson')
+
 def dump_defaults(app, kw):
     if app:
         kw.setdefault('cls', app.json_encoder)
+        if issubclass(kw['cls'], JSONEncoder):
+            kw.setdefault('types', app.json_types)
         if not app.config['JSON_AS_ASCII']:
             kw.setdefault('ensure_ascii', False)
         kw.setdefault('sort_keys', app.config['JSON_SORT_KEYS'])
@@ -58,38 +231,329 @@ def load_defaults(app, kw):
     else:
         kw.setdefault('cls', JSONDecoder)
 
-def _dumps(obj, **kw):
+
+_codec_cache_limit = 64
+
+
+class _Codecs(object):
+    # encoders and decoders of one app, valid while its config and
+    # encoder classes stay the same
+    def __init__(self, app):
+        self.generation = app.config.generation
+        self.encoder_class = app.json_encoder
+        self.decoder_class = app.json_decoder
+        self.backend = app.json_backend
+        self.pretty = app.config['JSONIFY_PRETTYPRINT_REGULAR']
+        self.encoders = {}
+        self.decoders = {}
+
+def _codecs(app):
+    rv = app._json_codecs
+    if (rv is None or rv.generation != app.config.generation
+            or rv.encoder_class is not app.json_encoder
+            or rv.decoder_class is not app.json_decoder):
+        rv = app._json_codecs = _Codecs(app)
+    return rv
+
+def _cached(app, cache, kw, make):
+    try:
+        key = tuple(sorted(kw.items())) if kw else ()
+        rv = cache.get(key, _missing)
+    except TypeError:
+        key, rv = None, _missing
+    if rv is _missing:
+        rv = make(app, kw)
+        if key is not None and len(cache) < _codec_cache_limit:
+            cache[key] = rv
+    return rv
+
+def _make_encoder(app, kw):
+    dump_defaults(app, kw)
+    return app.json_backend.make_encoder(**kw)
+
+def _make_decoder(app, kw):
+    load_defaults(app, kw)
+    return app.json_backend.make_decoder(**kw)
+
+def get_encoder(app, **kw):
+    """Returns the backend of `app` and an encoder for it with the
+    options `kw` over the config's defaults.  Encoders are made once
+    per config generation.
+    """
+    codecs = _codecs(app)
+    return codecs.backend, _cached(app, codecs.encoders, kw, _make_encoder)
+
+def get_decoder(app, **kw):
+    """Like :func:`get_encoder` for decoders."""
+    codecs = _codecs(app)
+    return codecs.backend, _cached(app, codecs.decoders, kw, _make_decoder)
+
+def _app_dumps(app, obj, **kw):
     encoding = kw.pop('encoding', None)
-    rv = _json.dumps(obj, **kw)
-    if encoding is not None and isinstance(rv, text_type):
+    backend, encoder = get_encoder(app, **kw)
+    if encoding is None:
+        return backend.encode(encoder, obj)
+    if _is_utf8(encoding):
+        return backend.encodeb(encoder, obj)
+    rv = backend.encode(encoder, obj)
+    if isinstance(rv, text_type):
         rv = rv.encode(encoding)
     return rv
 
-def _dump(obj, fp, **kw):
+def _app_loads(app, s, **kw):
     encoding = kw.pop('encoding', None)
-    if encoding is not None:
-        fp = _wrap_writer_for_text(fp, encoding)
-    _json.dump(obj, fp, **kw)
+    backend, decoder = get_decoder(app, **kw)
+    return backend.decode(decoder, s, encoding)
+
+class JSONBackend(object):
+    """Encodes and decodes JSON with a :mod:`json` compatible module.
+    Encoders and decoders are made once by :meth:`make_encoder` and
+    :meth:`make_decoder` and can then be used from any thread.  Backends
+    that can produce UTF-8 directly override :meth:`encodeb`.
+    """
+    #: whether :meth:`encodeb` is cheaper than :meth:`encode`
+    bytes_output = False
+
+    def __init__(self, module):
+        self.module = module
+
+    def _encoder_kw(self, kw):
+        # encoders are written against itsdangerous' json module, other
+        # modules only get to use their default hook
+        cls = kw.get('cls')
+        types = kw.get('types')
+        if cls is not None and not issubclass(cls, self.module.JSONEncoder):
+            del kw['cls']
+            kw.setdefault('default',
+                          self.default_for(cls, kw.pop('types', None)))
+        # simplejson writes decimals itself unless told not to
+        if (types is not None and types.resolve(decimal.Decimal) is not None
+                and getattr(self.module, '__name__', None) == 'simplejson'):
+            kw.setdefault('use_decimal', False)
+        return kw
+
+    def _decoder_kw(self, kw):
+        if kw.get('cls') is JSONDecoder:
+            del kw['cls']
+        return kw
+
+    def default_for(self, cls, types=None):
+        """Returns the ``default`` hook of encoder class `cls`."""
+        if types is not None:
+            return cls(types=types).default
+        return cls().default
+
+    def make_encoder(self, **kw):
+        kw = self._encoder_kw(kw)
+        cls = kw.pop('cls', None) or self.module.JSONEncoder
+        return cls(**kw)
+
+    def make_decoder(self, **kw):
+        kw = self._decoder_kw(kw)
+        cls = kw.pop('cls', None) or self.module.JSONDecoder
+        return cls(**kw)
+
+    def encode(self, encoder, obj):
+        return encoder.encode(obj)
+
+    def encodeb(self, encoder, obj):
+        """Like :meth:`encode` but always returns UTF-8 encoded bytes."""
+        rv = self.encode(encoder, obj)
+        if isinstance(rv, text_type):
+            rv = rv.encode('utf-8')
+        return rv
+
+    def decode(self, decoder, s, encoding=None):
+        if isinstance(s, bytes):
+            s = s.decode(encoding or 'utf-8')
+        return decoder.decode(s)
+
+    def dumps(self, obj, **kw):
+        encoding = kw.pop('encoding', None)
+        rv = self.encode(self.make_encoder(**kw), obj)
+        if encoding is not None and isinstance(rv, text_type):
+            rv = rv.encode(encoding)
+        return rv
+
+    def dumpb(self, obj, **kw):
+        kw.pop('encoding', None)
+        return self.encodeb(self.make_encoder(**kw), obj)
+
+    def dump(self, obj, fp, **kw):
+        encoding = kw.pop('encoding', None)
+        if encoding is not None:
+            fp = _wrap_writer_for_text(fp, encoding)
+        self.module.dump(obj, fp, **self._encoder_kw(kw))
+        _release_writer(fp)
+
+    def loads(self, s, **kw):
+        encoding = kw.pop('encoding', None)
+        return self.decode(self.make_decoder(**kw), s, encoding)
+
+    def load(self, fp, **kw):
+        if not PY2:
+            fp = _wrap_reader_for_text(fp, kw.pop('encoding', None) or 'utf-8')
+        return self.module.load(fp, **self._decoder_kw(kw))
+
+
+_non_ascii = re.compile(b'[\x80-\xff]')
+
+def _is_utf8(encoding):
+    return encoding.lower().replace('-', '') == 'utf8'
+
+
+class _ORJSONEncoder(object):
+    def __init__(self, option, default, ensure_ascii, fallback):
+        self.option = option
+        self.default = default
+        self.ensure_ascii = ensure_ascii
+        self.fallback = fallback
+
+
+class ORJSONBackend(JSONBackend):
+    """Encodes with `orjson`, which writes UTF-8 bytes natively.  Output
+    is compact or indented by two spaces, whatever the separators.  Calls
+    it can't serve in the same way as the standard library (custom
+    decoders, unsupported options, large ints, escaping non-ASCII) go to
+    the `fallback` backend.
+
+    Unlike the other backends, NaN and infinity are written as ``null``
+    and enum members as their value, even if a serializer is registered
+    for their class.  Checking for them would cost more than the encoding.
+    """
+
+    bytes_output = True
+    _encoder_options = frozenset(['cls', 'types', 'default', 'sort_keys',
+                                  'ensure_ascii', 'indent', 'separators'])
+
+    def __init__(self, fallback=None):
+        import orjson
+        JSONBackend.__init__(self, orjson)
+        self.fallback = fallback or default_backend
+        # dates go through the encoder's default hook like elsewhere
+        self.options = (orjson.OPT_NON_STR_KEYS |
+                        orjson.OPT_PASSTHROUGH_DATETIME |
+                        orjson.OPT_PASSTHROUGH_DATACLASS)
+
+    def _option(self, kw):
+        indent = kw.get('indent')
+        if indent not in (None, 2) or not self._encoder_options.issuperset(kw):
+            return None
+        option = self.options
+        if indent:
+            option |= self.module.OPT_INDENT_2
+        if kw.get('sort_keys'):
+            option |= self.module.OPT_SORT_KEYS
+        return option
+
+    def make_encoder(self, **kw):
+        fallback = self.fallback.make_encoder(**dict(kw))
+        types = kw.get('types')
+        default = kw.get('default') or \
+            self.default_for(kw.get('cls') or JSONEncoder, types)
+        option = self._option(kw)
+        # orjson writes uuids itself
+        if types is not None and types.resolve(uuid.UUID) is not str:
+            option = None
+        return _ORJSONEncoder(option, default,
+                              kw.get('ensure_ascii', True), fallback)
+
+    def make_decoder(self, **kw):
+        # None decodes with orjson
+        kw = self._decoder_kw(kw)
+        if kw:
+            return self.fallback.make_decoder(**kw)
+
+    def encodeb(self, encoder, obj):
+        if encoder.option is not None:
+            try:
+                rv = self.module.dumps(obj, option=encoder.option,
+                                       default=encoder.default)
+            except TypeError:
+                pass
+            else:
+                if not (encoder.ensure_ascii and _non_ascii.search(rv)):
+                    return rv
+        return self.fallback.encodeb(encoder.fallback, obj)
+
+    def encode(self, encoder, obj):
+        return self.encodeb(encoder, obj).decode('utf-8')
+
+    def decode(self, decoder, s, encoding=None):
+        if decoder is not None:
+            return self.fallback.decode(decoder, s, encoding)
+        if (encoding is not None and isinstance(s, bytes) and
+                not _is_utf8(encoding)):
+            s = s.decode(encoding)
+        return self.module.loads(s)
+
+    def dumps(self, obj, **kw):
+        encoding = kw.pop('encoding', None)
+        rv = self.dumpb(obj, **kw)
+        if encoding is None:
+            return rv.decode('utf-8')
+        if not _is_utf8(encoding):
+            rv = rv.decode('utf-8').encode(encoding)
+        return rv
+
+    def dump(self, obj, fp, **kw):
+        encoding = kw.pop('encoding', None)
+        if encoding is not None:
+            fp = _wrap_writer_for_text(fp, encoding)
+        fp.write(self.dumps(obj, **kw))
+        _release_writer(fp)
+
+    def load(self, fp, **kw):
+        return self.loads(fp.read(), **kw)
+
+
+default_backend = JSONBackend(_json)
+
+
+def _stdlib_backend():
+    import json
+    return JSONBackend(json)
+
+def _simplejson_backend():
+    import simplejson
+    return JSONBackend(simplejson)
+
+#: backends by name, each entry is called once to create the backend.
+#: A name that fails to import raises :exc:`ImportError` when selected
+backends = {
+    'stdlib': _stdlib_backend,
+    'simplejson': _simplejson_backend,
+    'orjson': ORJSONBackend,
+}
+
+def _dumps(obj, **kw):
+    return default_backend.dumps(obj, **kw)
+
+def _dump(obj, fp, **kw):
+    default_backend.dump(obj, fp, **kw)
 
 def _loads(s, **kw):
-    if isinstance(s, bytes):
-        s = s.decode(kw.pop('encoding', None) or 'utf-8')
-    return _json.loads(s, **kw)
+    return default_backend.loads(s, **kw)
 
 def _load(fp, **kw):
-    if not PY2:
-        fp = _wrap_reader_for_text(fp, kw.pop('encoding', None) or 'utf-8')
-    return _json.load(fp, **kw)
+    return default_backend.load(fp, **kw)
 
 def _wrap_reader_for_text(fp, encoding):
     if isinstance(fp.read(0), bytes):
         fp = io.TextIOWrapper(io.BufferedReader(fp), encoding)
     return fp
 
+class _TextWrapper(io.TextIOWrapper):
+    pass
+
 def _wrap_writer_for_text(fp, encoding):
     try:
         fp.write('')
     except TypeError:
-        fp = io.TextIOWrapper(fp, encoding)
+        fp = _TextWrapper(fp, encoding)
     return fp
 
+def _release_writer(fp):
+    # don't let the wrapper close the caller's file when collected
+    if isinstance(fp, _TextWrapper):
+        fp.detach()
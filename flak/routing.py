@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+
+import uuid
+from werkzeug.routing import (RoutingException, RequestRedirect, parse_rule,
+                              UnicodeConverter, IntegerConverter,
+                              PathConverter, UUIDConverter,
+                              DEFAULT_CONVERTERS)
+from werkzeug.exceptions import HTTPException, NotFound, MethodNotAllowed
+from .helpers import LRUCache
+from ._compat import itervalues, integer_types, text_type
+
+# converted url values of these types can be shared between requests
+_immutable_types = (bytes, text_type, float, bool, tuple,
+                    uuid.UUID, type(None)) + integer_types
+
+
+# cache key for allowed methods, can't be mistaken for a request method
+_allowed_key = object()
+
+# converters that give the same answer for the same path every time,
+# custom ones may validate against state that changes
+_builtin_converters = frozenset(DEFAULT_CONVERTERS.values())
+
+
+def _has_builtin_converters(rule):
+    for converter in itervalues(rule._converters):
+        if type(converter) not in _builtin_converters:
+            return False
+    return True
+
+
+def _is_shareable(view_args):
+    for value in itervalues(view_args):
+        if not isinstance(value, _immutable_types):
+            return False
+    return True
+
+
+def _match_domain(url_map, adapter):
+    return url_map.host_matching and adapter.server_name or adapter.subdomain
+
+
+def _match_path(url_map, adapter):
+    # the same "domain|/path" string werkzeug's MapAdapter.match builds
+    path_info = adapter.path_info
+    return u'%s|%s' % (_match_domain(url_map, adapter),
+                       path_info and '/%s' % path_info.lstrip('/'))
+
+
+def _rule_domain(url_map, rule):
+    if url_map.host_matching:
+        return rule.host or ''
+    return rule.subdomain or ''
+
+
+def _rule_path(url_map, rule):
+    return u'%s|%s' % (_rule_domain(url_map, rule), rule.rule)
+
+
+class RouteMatcher(object):
+    """Matches requests against an url map.  Rules without converters are
+    looked up in a ``(method, path)`` dict, recently matched dynamic paths
+    in a bounded LRU, and only misses go through werkzeug's linear
+    :meth:`MapAdapter.match`.  Matches are only cached when no custom
+    converter could have taken part in them.  The tables are rebuilt
+    whenever a rule is added to the map.
+    """
+
+    def __init__(self, url_map, cache_size=1024):
+        self.url_map = url_map
+        self.cache = LRUCache(cache_size)
+        self._static = {}
+        self._static_paths = frozenset()
+        self._allowed = {}
+        self._cacheable = frozenset()
+        self._cache_allowed = False
+        self._nrules = -1
+
+    def invalidate(self):
+        self._nrules = -1
+
+    def refresh(self):
+        url_map = self.url_map
+        url_map.update()
+        self._build(url_map)
+        self._allowed = {}
+        self.cache.clear()
+        # last, so other threads keep rebuilding until every table is done
+        self._nrules = len(url_map._rules)
+
+    def _build(self, url_map):
+        static = {}
+        done = set()
+        slashed = set()
+        for rule in url_map._rules:
+            if rule.build_only or rule._converters:
+                continue
+            path = _rule_path(url_map, rule)
+            if rule.rule.endswith('/'):
+                slashed.add(path)
+            if path + '/' in slashed:
+                # an earlier rule for the path with a slash redirects
+                # to it, or matches without the slash if not strict
+                done.add(path)
+            if path in done:
+                continue
+            if rule.redirect_to is not None or rule.defaults or rule.alias:
+                # these may redirect instead of matching, leave the
+                # remaining methods for this path to werkzeug
+                done.add(path)
+            elif rule.methods is None:
+                # matches every method, later rules are unreachable
+                static.setdefault((None, path), rule)
+                done.add(path)
+            else:
+                for method in rule.methods:
+                    static.setdefault((method, path), rule)
+        self._static = static
+        self._static_paths = frozenset(path for _, path in static)
+        # werkzeug tries rules in map order, a match can be cached if no
+        # rule before it has a custom converter.  Allowed methods come
+        # from every rule.
+        cacheable = set()
+        for rule in url_map._rules:
+            if rule.build_only:
+                continue
+            if not _has_builtin_converters(rule):
+                self._cache_allowed = False
+                break
+            cacheable.add(id(rule))
+        else:
+            self._cache_allowed = True
+        self._cacheable = cacheable
+
+    def rebuild_if_stale(self):
+        if self._nrules != len(self.url_map._rules):
+            self.refresh()
+
+    def match(self, adapter, method=None):
+        """Returns ``(rule, view_args)`` like ``adapter.match`` with
+        ``return_rule=True`` and raises the same routing exceptions.
+        """
+        self.rebuild_if_stale()
+        url_map = self.url_map
+        method = (method or adapter.default_method).upper()
+        path = _match_path(url_map, adapter)
+        static = self._static
+        rule = static.get((method, path)) or static.get((None, path))
+        if rule is not None:
+            return rule, {}
+        key = (method, path)
+        rv = self.cache.get(key)
+        if rv is not None:
+            return rv[0], dict(rv[1])
+        rule, view_args = self.match_uncached(adapter, method)
+        if id(rule) in self._cacheable and _is_shareable(view_args):
+            self.cache.set(key, (rule, view_args))
+            view_args = dict(view_args)
+        return rule, view_args
+
+    def match_uncached(self, adapter, method):
+        return adapter.match(method=method, return_rule=True)
+
+    def allowed_methods(self, adapter):
+        """Returns the methods valid for the adapter's path like
+        ``adapter.allowed_methods()``.  The answer for a path without
+        converters is kept until the map changes, other paths go through
+        the LRU.  Nothing is cached while the map has custom converters.
+        """
+        self.rebuild_if_stale()
+        if not self._cache_allowed:
+            return frozenset(self.allowed_methods_uncached(adapter))
+        path = _match_path(self.url_map, adapter)
+        if path in self._static_paths:
+            rv = self._allowed.get(path)
+            if rv is None:
+                rv = self._allowed[path] = \
+                    frozenset(self.allowed_methods_uncached(adapter))
+            return rv
+        key = (_allowed_key, path)
+        rv = self.cache.get(key)
+        if rv is None:
+            rv = frozenset(self.allowed_methods_uncached(adapter))
+            self.cache.set(key, rv)
+        return rv
+
+    def allowed_methods_uncached(self, adapter):
+        # werkzeug probes with a method no rule accepts
+        try:
+            self.match_uncached(adapter, '--')
+        except MethodNotAllowed as e:
+            return e.valid_methods
+        except HTTPException:
+            pass
+        return ()
+
+
+def _any_segment(segment):
+    return True
+
+
+def _int_segment(segment):
+    return segment.lstrip('-').isdigit()
+
+
+def _uuid_segment(segment):
+    return len(segment) == 36
+
+
+_segment_tests = {
+    UnicodeConverter: _any_segment,
+    IntegerConverter: _int_segment,
+    UUIDConverter: _uuid_segment,
+}
+
+
+class _Node(object):
+    __slots__ = ('static', 'dynamic', 'path', 'rules')
+
+    def __init__(self):
+        self.static = {}
+        self.dynamic = []
+        self.path = None
+        self.rules = []
+
+    def dynamic_child(self, test):
+        for other, node in self.dynamic:
+            if other is test:
+                return node
+        node = _Node()
+        self.dynamic.append((test, node))
+        return node
+
+    def collect(self, segments, pos, out):
+        if pos == len(segments):
+            out.extend(self.rules)
+            return
+        segment = segments[pos]
+        child = self.static.get(segment)
+        if child is not None:
+            child.collect(segments, pos + 1, out)
+        for test, child in self.dynamic:
+            if test(segment):
+                child.collect(segments, pos + 1, out)
+        if self.path is not None and segment:
+            for end in range(pos + 1, len(segments) + 1):
+                self.path.collect(segments, end, out)
+
+
+def _rule_segments(url_map, rule):
+    """Splits a rule into path segments, each either a literal string or
+    a converter test.  Returns `None` for rules the tree can't represent:
+    dynamic domains, custom converters and segments that mix text and
+    converters.
+    """
+    domain = _rule_domain(url_map, rule)
+    for converter, _, _ in parse_rule(domain):
+        if converter is not None:
+            return None
+    segments = [[]]
+    for converter, _, data in parse_rule(rule.rule):
+        if converter is None:
+            pieces = data.split('/')
+            segments[-1].append(pieces[0])
+            segments.extend([piece] for piece in pieces[1:])
+        elif type(rule._converters[data]) is PathConverter:
+            segments[-1].append(PathConverter)
+        else:
+            test = _segment_tests.get(type(rule._converters[data]))
+            if test is None:
+                return None
+            segments[-1].append(test)
+    # drop the leading and a trailing slash
+    segments = segments[1:]
+    if segments and segments[-1] == ['']:
+        segments.pop()
+    rv = []
+    for parts in segments:
+        parts = [x for x in parts if x != '']
+        if len(parts) != 1:
+            return None
+        rv.append(parts[0])
+    return domain, rv
+
+
+class RadixMatcher(RouteMatcher):
+    """A :class:`RouteMatcher` that replaces werkzeug's linear scan over
+    all rules with a segment tree.  The tree only preselects the rules
+    that could match a path, which are then tried in map order with their
+    own regular expressions, so ordering, converter validation, strict
+    slashes and 405 responses behave exactly like :meth:`MapAdapter.match`.
+    Rules the tree can't represent are always tried.
+    """
+
+    def _build(self, url_map):
+        RouteMatcher._build(self, url_map)
+        trees = {}
+        opaque = []
+        for index, rule in enumerate(url_map._rules):
+            if rule.build_only:
+                continue
+            rv = _rule_segments(url_map, rule)
+            if rv is None:
+                opaque.append((index, rule))
+                continue
+            domain, segments = rv
+            node = trees.get(domain)
+            if node is None:
+                node = trees[domain] = _Node()
+            for segment in segments:
+                if segment is PathConverter:
+                    if node.path is None:
+                        node.path = _Node()
+                    node = node.path
+                elif callable(segment):
+                    node = node.dynamic_child(segment)
+                else:
+                    child = node.static.get(segment)
+                    if child is None:
+                        child = node.static[segment] = _Node()
+                    node = child
+            node.rules.append((index, rule))
+        self._trees = trees
+        self._opaque = opaque
+
+    def candidates(self, adapter):
+        rv = list(self._opaque)
+        tree = self._trees.get(_match_domain(self.url_map, adapter))
+        if tree is not None:
+            path = adapter.path_info.lstrip('/').rstrip('/')
+            tree.collect(path and path.split('/') or [], 0, rv)
+        # rules in map order, a rule with several path converters can be
+        # reached more than once
+        rules = dict(rv)
+        return [rules[index] for index in sorted(rules)]
+
+    def match_uncached(self, adapter, method):
+        url_map = self.url_map
+        path = _match_path(url_map, adapter)
+        have_match_for = set()
+        for rule in self.candidates(adapter):
+            try:
+                rv = rule.match(path)
+            except RoutingException:
+                # slash and alias redirects, let werkzeug build the url
+                return adapter.match(method=method, return_rule=True)
+            if rv is None:
+                continue
+            if rule.methods is not None and method not in rule.methods:
+                have_match_for.update(rule.methods)
+                continue
+            if rule.redirect_to is not None:
+                return adapter.match(method=method, return_rule=True)
+            if url_map.redirect_defaults:
+                redirect_url = adapter.get_default_redirect(
+                    rule, method, rv, adapter.query_args)
+                if redirect_url is not None:
+                    raise RequestRedirect(redirect_url)
+            return rule, rv
+        if have_match_for:
+            raise MethodNotAllowed(valid_methods=list(have_match_for))
+        raise NotFound()
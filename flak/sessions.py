@@ -1,20 +1,49 @@
 # -*- coding: utf-8 -*-
+import io
+import os
+import zlib
+import time
+import struct
+import calendar
 import uuid
+import hmac
 import hashlib
+import binascii
+import tempfile
+import threading
+from copy import deepcopy
 from base64 import b64encode, b64decode
-from datetime import datetime
-from werkzeug.http import http_date, parse_date
+from datetime import datetime, timedelta
+from weakref import WeakKeyDictionary
+from werkzeug.http import http_date, parse_date, cookie_date, dump_cookie
 from werkzeug.datastructures import CallbackDict
 from . import json
-from ._compat import iteritems, text_type
+from .helpers import LRUCache
+from ._compat import iteritems, text_type, integer_types
 
-from itsdangerous import URLSafeTimedSerializer, BadSignature
+from itsdangerous import (URLSafeTimedSerializer, TimestampSigner,
+                          BadSignature, BadPayload, want_bytes, base64_encode)
+try:
+    from itsdangerous.signer import SigningAlgorithm
+except ImportError:
+    from itsdangerous import SigningAlgorithm
+
+
+_epoch = datetime(1970, 1, 1)
+_scalar_types = (text_type, bytes, int, float, bool, type(None))
 
 
 def total_seconds(td):
     return td.days * 60 * 60 * 24 + td.seconds
 
 
+def _copy_data(data):
+    for value in data.values():
+        if not isinstance(value, _scalar_types):
+            return deepcopy(data)
+    return dict(data)
+
+
 class SessionMixin(object):
     new = False
     modified = True
@@ -29,21 +58,23 @@ class SessionMixin(object):
     del _get_permanent, _set_permanent
 
 
-def _tag(value):
+def _tag_slow(value):
+    # subclasses and types missing from the table, in the order the
+    # format has always been checked
     if isinstance(value, tuple):
-        return {' t': [_tag(x) for x in value]}
+        return _tag_tuple(value)
     elif isinstance(value, uuid.UUID):
         return {' u': value.hex}
     elif isinstance(value, bytes):
-        return {' b': b64encode(value).decode('ascii')}
+        return _tag_bytes(value)
     elif callable(getattr(value, '__html__', None)):
         return {' m': text_type(value.__html__())}
     elif isinstance(value, list):
-        return [_tag(x) for x in value]
+        return _tag_list(value)
     elif isinstance(value, datetime):
         return {' d': http_date(value)}
     elif isinstance(value, dict):
-        return dict((k, _tag(v)) for k, v in iteritems(value))
+        return _tag_dict(value)
     elif isinstance(value, str):
         try:
             return text_type(value)
@@ -56,32 +87,376 @@ def _tag(value):
     return value
 
 
+def _tag(value):
+    """Returns `value` with the types JSON can't represent replaced by
+    tagged objects.  Containers are only copied when something inside
+    them was replaced, so plain data is passed through as it is.
+    """
+    tag = _taggers.get(value.__class__)
+    if tag is None:
+        return _tag_slow(value)
+    if tag is _identity:
+        return value
+    return tag(value)
+
+
+def _identity(value):
+    return value
+
+
+def _tag_dict(value):
+    rv = None
+    for k, v in iteritems(value):
+        tagged = _tag(v)
+        if tagged is not v:
+            if rv is None:
+                rv = dict(value)
+            rv[k] = tagged
+    return value if rv is None else rv
+
+
+def _tag_list(value):
+    rv = None
+    for i, v in enumerate(value):
+        tagged = _tag(v)
+        if tagged is not v:
+            if rv is None:
+                rv = list(value)
+            rv[i] = tagged
+    return value if rv is None else rv
+
+
+def _tag_tuple(value):
+    return {' t': [_tag(x) for x in value]}
+
+
+def _tag_bytes(value):
+    return {' b': b64encode(value).decode('ascii')}
+
+
+_taggers = {
+    dict: _tag_dict,
+    list: _tag_list,
+    tuple: _tag_tuple,
+    bytes: _tag_bytes,
+    text_type: _identity,
+    float: _identity,
+    bool: _identity,
+    type(None): _identity,
+    uuid.UUID: lambda value: {' u': value.hex},
+    datetime: lambda value: {' d': http_date(value)},
+}
+for _type in integer_types:
+    _taggers[_type] = _identity
+del _type
+
+_untaggers = {
+    ' t': tuple,
+    ' u': uuid.UUID,
+    ' b': b64decode,
+    ' d': parse_date,
+}
+
+
+def _untag(obj):
+    if len(obj) == 1:
+        for key in obj:
+            untag = _untaggers.get(key)
+            if untag is not None:
+                return untag(obj[key])
+    return obj
+
+
 class TaggedJsonSerializer(object):
+    """Serializes session data with the app's JSON settings.  It holds
+    no per-request state and can be shared between threads.
+    """
 
-    def __init__(self, cx):
-        self.cx = cx
+    def __init__(self, app):
+        self.app = app
 
     def dumps(self, value):
-        return self.cx.dumps(_tag(value), separators=(',', ':'))
+        backend, encoder = json.get_encoder(self.app, separators=(',', ':'))
+        return backend.encode(encoder, _tag(value))
 
     def loads(self, value):
-        def object_hook(obj):
-            if len(obj) != 1:
-                return obj
-            the_key, the_value = next(iteritems(obj))
-            if the_key == ' t':
-                return tuple(the_value)
-            elif the_key == ' u':
-                return uuid.UUID(the_value)
-            elif the_key == ' b':
-                return b64decode(the_value)
-            elif the_key == ' d':
-                return parse_date(the_value)
-            return obj
-        return self.cx.loads(value, object_hook=object_hook)
+        backend, decoder = json.get_decoder(self.app, object_hook=_untag)
+        return backend.decode(decoder, value)
+
+
+def _write_varint(out, n):
+    while n > 0x7f:
+        out.append(0x80 | (n & 0x7f))
+        n >>= 7
+    out.append(n)
+
+
+def _write_int(out, n):
+    # zigzag, so small negative numbers stay short
+    _write_varint(out, n * 2 if n >= 0 else -n * 2 - 1)
+
+
+def _write_bytes(out, tag, data):
+    out.append(tag)
+    _write_varint(out, len(data))
+    out.extend(data)
+
+
+def _encode(out, value, types=None):
+    if value is None:
+        out.append(_N)
+    elif value is True:
+        out.append(_T)
+    elif value is False:
+        out.append(_F)
+    elif isinstance(value, integer_types):
+        out.append(_I)
+        _write_int(out, value)
+    elif isinstance(value, float):
+        out.append(_R)
+        out.extend(_double.pack(value))
+    elif isinstance(value, text_type):
+        _write_bytes(out, _S, value.encode('utf-8'))
+    elif isinstance(value, dict):
+        out.append(_D)
+        _write_varint(out, len(value))
+        for k, v in iteritems(value):
+            _encode(out, k, types)
+            _encode(out, v, types)
+    elif isinstance(value, list):
+        out.append(_L)
+        _write_varint(out, len(value))
+        for x in value:
+            _encode(out, x, types)
+    elif isinstance(value, tuple):
+        out.append(_TU)
+        _write_varint(out, len(value))
+        for x in value:
+            _encode(out, x, types)
+    elif isinstance(value, uuid.UUID):
+        out.append(_U)
+        out.extend(value.bytes)
+    elif isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.replace(tzinfo=None) - value.utcoffset()
+        out.append(_DT)
+        _write_int(out, calendar.timegm(value.timetuple()))
+        _write_varint(out, value.microsecond)
+    elif callable(getattr(value, '__html__', None)):
+        _write_bytes(out, _S, text_type(value.__html__()).encode('utf-8'))
+    elif isinstance(value, bytes):
+        _write_bytes(out, _B, value)
+    else:
+        f = types is not None and types.resolve(type(value))
+        if not f:
+            raise TypeError('%r can not be stored in the session' % (value,))
+        _encode(out, f(value), types)
+
+
+class _Reader(object):
+    __slots__ = ('data', 'pos')
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def varint(self):
+        data = self.data
+        pos = self.pos
+        shift = rv = 0
+        while True:
+            b = data[pos]
+            pos += 1
+            rv |= (b & 0x7f) << shift
+            if b < 0x80:
+                break
+            shift += 7
+        self.pos = pos
+        return rv
+
+    def signed(self):
+        n = self.varint()
+        return n >> 1 if not n & 1 else -((n + 1) >> 1)
+
+    def take(self, n):
+        pos = self.pos
+        self.pos = pos + n
+        if self.pos > len(self.data):
+            raise ValueError('truncated session data')
+        return bytes(self.data[pos:self.pos])
+
+    def value(self):
+        tag = self.data[self.pos]
+        self.pos += 1
+        if tag == _S:
+            return self.take(self.varint()).decode('utf-8')
+        elif tag == _I:
+            return self.signed()
+        elif tag == _D:
+            rv = {}
+            for _ in range(self.varint()):
+                k = self.value()
+                rv[k] = self.value()
+            return rv
+        elif tag == _L:
+            return [self.value() for _ in range(self.varint())]
+        elif tag == _TU:
+            return tuple([self.value() for _ in range(self.varint())])
+        elif tag == _N:
+            return None
+        elif tag == _T:
+            return True
+        elif tag == _F:
+            return False
+        elif tag == _R:
+            return _double.unpack(self.take(8))[0]
+        elif tag == _B:
+            return self.take(self.varint())
+        elif tag == _U:
+            return uuid.UUID(bytes=self.take(16))
+        elif tag == _DT:
+            rv = _epoch + timedelta(seconds=self.signed())
+            return rv.replace(microsecond=self.varint())
+        raise ValueError('unknown session data tag %r' % tag)
+
+
+_N, _T, _F, _I, _R, _S, _B, _D, _L, _TU, _U, _DT = bytearray(b'NTFirsbdltuD')
+_double = struct.Struct('>d')
+_compact_marker = b'\x01'
+
+
+class CompactSessionSerializer(object):
+    """A session serializer with a binary format that is much smaller than
+    tagged JSON for bytes, uuids, datetimes and tuples.  Cookies written
+    by :class:`TaggedJsonSerializer` can still be read, so an app can
+    switch without logging users out::
+
+        class SessionInterface(SecureCookieSessionInterface):
+            serializer = CompactSessionSerializer
+
+    Payloads longer than :attr:`compress_threshold` bytes are zlib
+    compressed by the signing serializer, shorter ones are not worth it.
+    """
+    compress_threshold = 256
+
+    def __init__(self, app):
+        self.app = app
+        self._json = TaggedJsonSerializer(app)
+
+    def dumps(self, value):
+        out = bytearray(_compact_marker)
+        _encode(out, value, self.app.json_types)
+        return bytes(out)
+
+    def loads(self, value):
+        value = want_bytes(value)
+        if not value.startswith(_compact_marker):
+            return self._json.loads(value)
+        reader = _Reader(bytearray(value))
+        reader.pos = 1
+        try:
+            return reader.value()
+        except (IndexError, ValueError, UnicodeError, struct.error) as e:
+            raise BadPayload('Could not decode the session data',
+                             original_error=e)
+
+
+class _KeyedAlgorithm(SigningAlgorithm):
+    # keeps the MAC state after processing the key and copies it for
+    # every signature.  Only a few keys are alive at once (rotation)
+    def __init__(self):
+        self._macs = {}
+
+    def make_mac(self, key):
+        raise NotImplementedError()
+
+    def get_signature(self, key, value):
+        mac = self._macs.get(key)
+        if mac is None:
+            if len(self._macs) >= 16:
+                self._macs.clear()
+            mac = self._macs[key] = self.make_mac(key)
+        mac = mac.copy()
+        mac.update(value)
+        return mac.digest()
+
+
+class PrecomputedHMACAlgorithm(_KeyedAlgorithm):
+    """HMAC with the inner and outer pad state computed once per key.
+    Signatures are the same as itsdangerous' :class:`HMACAlgorithm`, so
+    existing cookies stay valid.
+    """
+
+    def __init__(self, digest_method=hashlib.sha1):
+        _KeyedAlgorithm.__init__(self)
+        self.digest_method = digest_method
+
+    def make_mac(self, key):
+        return hmac.new(key, digestmod=self.digest_method)
+
+
+class Blake2bAlgorithm(_KeyedAlgorithm):
+    """Keyed BLAKE2b, which is a MAC on its own and cheaper than HMAC.
+    Needs Python 3.6.  Changing to it invalidates existing cookies.
+    """
+
+    def __init__(self, digest_size=32):
+        if not hasattr(hashlib, 'blake2b'):
+            raise RuntimeError('hashlib.blake2b is not available, it '
+                               'requires Python 3.6 or later')
+        _KeyedAlgorithm.__init__(self)
+        self.digest_size = digest_size
+
+    def make_mac(self, key):
+        if len(key) > hashlib.blake2b.MAX_KEY_SIZE:
+            key = hashlib.blake2b(key).digest()
+        return hashlib.blake2b(key=key, digest_size=self.digest_size)
+
+
+class _KeyCachingSigner(TimestampSigner):
+    # the derived key only depends on the secret key and salt
+    _derived_key = None
+
+    def derive_key(self):
+        key = self._derived_key
+        if key is None:
+            key = self._derived_key = TimestampSigner.derive_key(self)
+        return key
+
+
+class _SigningSerializer(URLSafeTimedSerializer):
+    default_signer = _KeyCachingSigner
+    _signer = None
+
+    def dump_payload(self, obj):
+        # URLSafeSerializerMixin.dump_payload, but payloads up to the
+        # session serializer's threshold skip the compression attempt
+        data = want_bytes(self.serializer.dumps(obj))
+        threshold = getattr(self.serializer, 'compress_threshold', 0)
+        if len(data) > threshold:
+            compressed = zlib.compress(data)
+            if len(compressed) < len(data) - 1:
+                return b'.' + base64_encode(compressed)
+        return base64_encode(data)
+
+    def make_signer(self, salt=None):
+        # itsdangerous 1.0 and later pass our own salt when verifying
+        if salt is not None and salt != self.salt:
+            return URLSafeTimedSerializer.make_signer(self, salt)
+        signer = self._signer
+        if signer is None:
+            signer = self._signer = URLSafeTimedSerializer.make_signer(self)
+        return signer
 
 
 class SecureCookieSession(CallbackDict, SessionMixin):
+    #: when the cookie the session was read from was signed, in seconds
+    #: since the epoch
+    signed_at = None
+    #: the serialized payload of that cookie, used to tell whether writes
+    #: actually changed the content
+    payload = None
+
     def __init__(self, initial=None):
         def on_update(self):
             self.modified = True
@@ -98,6 +473,39 @@ class NullSession(SecureCookieSession):
     del _nop
 
 
+class _CookieTemplate(object):
+    # the Set-Cookie header dump_cookie would build, split around the
+    # value and the expiry date
+    value_marker = 'FLAKCOOKIEVALUE'
+    expires_marker = 'FLAKCOOKIEEXPIRES'
+
+    def __init__(self, name, domain, path, secure, httponly):
+        self.name = name
+        self.domain = domain
+        self.path = path
+        kw = dict(domain=domain, path=path, secure=secure,
+                  httponly=httponly)
+        header = dump_cookie(name, self.value_marker, **kw)
+        self.prefix, self.suffix = header.split(self.value_marker)
+        header = dump_cookie(name, self.value_marker,
+                             expires=self.expires_marker, **kw)
+        rest = header.split(self.value_marker)[1]
+        self.expires_prefix, self.expires_suffix = \
+            rest.split(self.expires_marker)
+
+    def set_cookie(self, response, value, expires=None):
+        """Adds the cookie, `value` must not need quoting."""
+        if expires is None:
+            header = self.prefix + value + self.suffix
+        else:
+            header = (self.prefix + value + self.expires_prefix +
+                      cookie_date(expires) + self.expires_suffix)
+        response.headers.add('Set-Cookie', header)
+
+    def delete_cookie(self, response):
+        response.delete_cookie(self.name, domain=self.domain, path=self.path)
+
+
 class SessionInterface(object):
     null_session_class = NullSession
 
@@ -139,11 +547,39 @@ class SessionInterface(object):
         if session.permanent:
             return datetime.utcnow() + app.permanent_session_lifetime
 
+    def get_cookie_template(self, app):
+        """Returns the session cookie's attributes as pre-serialized
+        ``Set-Cookie`` pieces, computed once per config generation.
+        """
+        generation = app.config.generation
+        templates = self.__dict__.get('_cookie_templates')
+        if templates is None:
+            templates = self._cookie_templates = WeakKeyDictionary()
+        cached = templates.get(app)
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+        rv = _CookieTemplate(app.session_cookie_name,
+                             self.get_cookie_domain(app),
+                             self.get_cookie_path(app),
+                             self.get_cookie_secure(app),
+                             self.get_cookie_httponly(app))
+        templates[app] = (generation, rv)
+        return rv
+
     def should_set_cookie(self, app, session):
         if session.modified:
             return True
         save_each = app.config['SESSION_REFRESH_EACH_REQUEST']
-        return save_each and session.permanent
+        if not (save_each and session.permanent):
+            return False
+        # with a refresh fraction the cookie is only re-issued once it is
+        # that far into its lifetime
+        fraction = app.config['SESSION_REFRESH_FRACTION']
+        signed_at = getattr(session, 'signed_at', None)
+        if fraction is None or signed_at is None:
+            return True
+        lifetime = total_seconds(app.permanent_session_lifetime)
+        return time.time() - signed_at >= fraction * lifetime
 
     def open_session(self, cx):
         return self.null_session_class()
@@ -156,38 +592,128 @@ class SecureCookieSessionInterface(SessionInterface):
     salt = 'cookie-session'
     key_derivation = 'hmac'
     digest_method = staticmethod(hashlib.sha1)
+    #: the itsdangerous signing algorithm, `None` for a plain HMAC with
+    #: :attr:`digest_method`.  See :class:`PrecomputedHMACAlgorithm` and
+    #: :class:`Blake2bAlgorithm`
+    signer_algorithm = None
     serializer = TaggedJsonSerializer
     session_class = SecureCookieSession
 
+    def _signing_state(self, app):
+        # ([(key id, serializer)], cookie cache) for the app, newest key
+        # first, rebuilt when the keys or the signing settings change
+        key = (app.secret_key, tuple(app.config['SECRET_KEY_FALLBACKS']),
+               self.salt, self.key_derivation, self.digest_method,
+               self.signer_algorithm, self.serializer,
+               app.config['SESSION_COOKIE_CACHE_SIZE'])
+        serializers = self.__dict__.get('_serializers')
+        if serializers is None:
+            serializers = self._serializers = WeakKeyDictionary()
+        cached = serializers.get(app)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        size = key[-1]
+        keys = [app.secret_key] + list(app.config['SECRET_KEY_FALLBACKS'])
+        rv = ([(self.get_key_id(k), self.make_signing_serializer(app, k))
+               for k in keys],
+              LRUCache(size) if size else None)
+        serializers[app] = (key, rv)
+        return rv
+
     def get_signing_serializer(self, cx):
+        """Returns the serializer for the app's current secret key, built
+        once and reused until the keys or the signing settings change.
+        """
         if not cx.app.secret_key:
             return None
+        return self._signing_state(cx.app)[0][0][1]
+
+    def get_cookie_cache(self, app):
+        """Returns the :class:`~flak.helpers.LRUCache` of verified session
+        cookies for `app`, or `None` unless ``SESSION_COOKIE_CACHE_SIZE``
+        is set.  Its length and ``hit_rate`` can be used for monitoring.
+        """
+        if not app.secret_key:
+            return None
+        return self._signing_state(app)[1]
+
+    def get_key_id(self, secret_key):
+        """A short id for `secret_key` that is put in front of cookies, so
+        that verification can go straight to the key that signed them.
+        """
+        digest = hashlib.sha1(want_bytes(self.salt) + b'|' +
+                              want_bytes(secret_key)).digest()
+        return base64_encode(digest[:3]).decode('ascii')
+
+    def make_signing_serializer(self, app, secret_key=None):
+        if secret_key is None:
+            secret_key = app.secret_key
         signer_kwargs = dict(key_derivation=self.key_derivation,
-                             digest_method=self.digest_method)
-        return URLSafeTimedSerializer(cx.app.secret_key, salt=self.salt,
-                                      serializer=self.serializer(cx),
-                                      signer_kwargs=signer_kwargs)
+                             digest_method=self.digest_method,
+                             algorithm=self.signer_algorithm)
+        return _SigningSerializer(secret_key, salt=self.salt,
+                                  serializer=self.serializer(app),
+                                  signer_kwargs=signer_kwargs)
 
     def open_session(self, cx):
         app = cx.app
         rq = cx.request
-        s = self.get_signing_serializer(cx)
-        if s is None:
+        if not app.secret_key:
             return self.null_session_class()
         val = rq.cookies.get(app.session_cookie_name)
         if not val:
             return self.session_class()
+        serializers, cache = self._signing_state(app)
+        # cookies start with the id of the key that signed them, only
+        # cookies from before key ids need every key tried
+        key_id, sep, signed = val.partition('~')
+        if sep:
+            candidates = [x for x in serializers if x[0] == key_id]
+        else:
+            signed = val
+            candidates = serializers
         max_age = total_seconds(app.permanent_session_lifetime)
-        try:
-            data = s.loads(val, max_age=max_age)
-            return self.session_class(data)
-        except BadSignature:
-            return self.session_class()
+        for key_id, s in candidates:
+            try:
+                if cache is not None:
+                    data, signed_at = self._load_cached(s, cache, signed,
+                                                        max_age)
+                else:
+                    data, timestamp = s.loads(signed, max_age=max_age,
+                                              return_timestamp=True)
+                    signed_at = total_seconds(timestamp - _epoch)
+            except BadSignature:
+                continue
+            session = self.session_class(data)
+            session.signed_at = signed_at
+            if s is serializers[0][1]:
+                session.payload = want_bytes(signed).rsplit(b'.', 2)[0]
+            else:
+                # signed with an old key, sign again with the current one
+                session.modified = True
+            return session
+        return self.session_class()
+
+    def _load_cached(self, s, cache, val, max_age):
+        # a cookie seen before skips signature checking and decoding, only
+        # its age is checked again.  Sessions get their own copy of the data
+        key = (s, val)
+        rv = cache.get(key)
+        if rv is None:
+            data, timestamp = s.loads(val, max_age=max_age,
+                                      return_timestamp=True)
+            rv = (data, total_seconds(timestamp - _epoch))
+            cache.set(key, rv)
+        elif int(time.time()) - rv[1] > max_age:
+            cache.pop(key)
+            raise BadSignature('Signature age > %s seconds' % max_age)
+        return _copy_data(rv[0]), rv[1]
 
     def save_session(self, cx, response):
+        if not cx.session_opened:
+            return
         app = cx.app
-        domain = self.get_cookie_domain(app)
-        path = self.get_cookie_path(app)
+        cookie = self.get_cookie_template(app)
 
         # Delete case.  If there is no session we bail early.
         # If the session was modified to be empty we remove the
@@ -195,8 +721,7 @@ class SecureCookieSessionInterface(SessionInterface):
         session = cx.session
         if not session:
             if session.modified:
-                response.delete_cookie(app.session_cookie_name,
-                                       domain=domain, path=path)
+                cookie.delete_cookie(response)
             return
 
         # Modification case.  There are upsides and downsides to
@@ -205,15 +730,280 @@ class SecureCookieSessionInterface(SessionInterface):
         # which performs a quick check to figure out if the cookie
         # should be set or not.  This is controlled by the
         # SESSION_REFRESH_EACH_REQUEST config flag as well as
-        # the permanent flag on the session itself.
+        # the permanent flag on the session itself.  Writes that left
+        # the content as it was in the cookie don't count as
+        # modifications.
+        key_id, s = self._signing_state(app)[0][0]
+        payload = None
+        if session.modified and getattr(session, 'payload', None):
+            payload = s.dump_payload(dict(session))
+            if payload == session.payload:
+                session.modified = False
         if not self.should_set_cookie(app, session):
             return
 
-        httponly = self.get_cookie_httponly(app)
-        secure = self.get_cookie_secure(app)
-        expires = self.get_expiration_time(app, session)
-        val = self.get_signing_serializer(cx).dumps(dict(session))
-        response.set_cookie(app.session_cookie_name, val,
-                            expires=expires, httponly=httponly,
-                            domain=domain, path=path, secure=secure)
+        if payload is None:
+            payload = s.dump_payload(dict(session))
+        val = '%s~%s' % (key_id, s.make_signer().sign(payload).decode('ascii'))
+        cookie.set_cookie(response, val,
+                          self.get_expiration_time(app, session))
+
+
+class ServerSideSession(SecureCookieSession):
+    def __init__(self, initial=None, sid=None, new=False):
+        SecureCookieSession.__init__(self, initial)
+        self.sid = sid
+        self.new = new
+
+
+class SessionStore(object):
+    """Keeps serialized session data for :class:`ServerSideSessionInterface`
+    by session id.  Data expires `ttl` seconds after it was last saved or
+    touched.
+    """
+
+    def load(self, sid):
+        """Returns the data saved for `sid`, or `None`."""
+        raise NotImplementedError()
+
+    def save(self, sid, data, ttl):
+        raise NotImplementedError()
+
+    def touch(self, sid, ttl):
+        """Extends the lifetime of unchanged data."""
+        data = self.load(sid)
+        if data is not None:
+            self.save(sid, data, ttl)
+
+    def delete(self, sid):
+        raise NotImplementedError()
+
+
+class MemorySessionStore(SessionStore):
+    """Keeps sessions in a bounded in-process LRU.  Data is lost on
+    restart and not shared between processes.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.cache = LRUCache(maxsize)
+
+    def load(self, sid):
+        rv = self.cache.get(sid)
+        if rv is None:
+            return None
+        if rv[1] < time.time():
+            self.cache.pop(sid)
+            return None
+        return rv[0]
+
+    def save(self, sid, data, ttl):
+        self.cache.set(sid, (data, time.time() + ttl))
+
+    def delete(self, sid):
+        self.cache.pop(sid)
+
+
+class SqliteSessionStore(SessionStore):
+    """Keeps sessions in a sqlite database in WAL mode, so readers don't
+    block the writer.  Every thread gets its own connection, which keeps
+    the compiled statements cached.
+    """
+
+    def __init__(self, path, table='sessions'):
+        self.path = path
+        self.table = table
+        self._local = threading.local()
+        self._load = ('SELECT data FROM %s WHERE sid = ? AND expires > ?'
+                      % table)
+        self._save = 'INSERT OR REPLACE INTO %s VALUES (?, ?, ?)' % table
+        self._touch = 'UPDATE %s SET expires = ? WHERE sid = ?' % table
+        self._delete = 'DELETE FROM %s WHERE sid = ?' % table
+        self._cleanup = 'DELETE FROM %s WHERE expires <= ?' % table
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS %s (sid TEXT PRIMARY KEY, '
+            'data TEXT NOT NULL, expires REAL NOT NULL)' % table)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            import sqlite3
+            conn = sqlite3.connect(self.path, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def load(self, sid):
+        row = self._connect().execute(self._load,
+                                      (sid, time.time())).fetchone()
+        return row and row[0]
+
+    def save(self, sid, data, ttl):
+        self._connect().execute(self._save, (sid, data, time.time() + ttl))
+
+    def touch(self, sid, ttl):
+        self._connect().execute(self._touch, (time.time() + ttl, sid))
+
+    def delete(self, sid):
+        self._connect().execute(self._delete, (sid,))
+
+    def cleanup(self):
+        """Removes expired sessions."""
+        self._connect().execute(self._cleanup, (time.time(),))
+
+
+class FileSessionStore(SessionStore):
+    """Keeps every session in its own file in `directory`.  The file's
+    modification time is set to the expiry time.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, sid):
+        return os.path.join(self.directory, sid)
+
+    def load(self, sid):
+        path = self._path(sid)
+        try:
+            if os.path.getmtime(path) < time.time():
+                return None
+            with io.open(path, encoding='utf-8') as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def save(self, sid, data, ttl):
+        path = self._path(sid)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        try:
+            with io.open(fd, 'w', encoding='utf-8') as f:
+                f.write(text_type(data))
+            expires = time.time() + ttl
+            os.utime(tmp, (expires, expires))
+            try:
+                os.rename(tmp, path)
+            except OSError:
+                # windows doesn't replace existing files
+                os.remove(path)
+                os.rename(tmp, path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def touch(self, sid, ttl):
+        expires = time.time() + ttl
+        try:
+            os.utime(self._path(sid), (expires, expires))
+        except OSError:
+            pass
+
+    def delete(self, sid):
+        try:
+            os.remove(self._path(sid))
+        except OSError:
+            pass
+
+    def cleanup(self):
+        """Removes expired sessions."""
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < now:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Keeps session data in a :class:`SessionStore` and only a signed
+    session id in the cookie.  Data is only written to the store when the
+    session was modified::
+
+        app.session_interface = ServerSideSessionInterface(
+            SqliteSessionStore('/var/lib/myapp/sessions.db'))
+    """
+    salt = 'server-session'
+    key_derivation = 'hmac'
+    digest_method = staticmethod(hashlib.sha1)
+    serializer = TaggedJsonSerializer
+    session_class = ServerSideSession
+
+    def __init__(self, store=None):
+        if store is None:
+            store = MemorySessionStore()
+        self.store = store
+        self._signers = WeakKeyDictionary()
+
+    def get_signer(self, app):
+        if not app.secret_key:
+            return None
+        key = (app.secret_key, self.salt, self.key_derivation,
+               self.digest_method)
+        cached = self._signers.get(app)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        rv = _KeyCachingSigner(app.secret_key, salt=self.salt,
+                               key_derivation=self.key_derivation,
+                               digest_method=self.digest_method)
+        self._signers[app] = (key, rv)
+        return rv
+
+    def generate_sid(self):
+        return binascii.hexlify(os.urandom(16)).decode('ascii')
+
+    def open_session(self, cx):
+        app = cx.app
+        signer = self.get_signer(app)
+        if signer is None:
+            return self.null_session_class()
+        val = cx.request.cookies.get(app.session_cookie_name)
+        if val:
+            max_age = total_seconds(app.permanent_session_lifetime)
+            try:
+                sid, timestamp = signer.unsign(val, max_age=max_age,
+                                               return_timestamp=True)
+                sid = sid.decode('ascii')
+            except BadSignature:
+                sid = None
+            data = sid and self.store.load(sid)
+            if data is not None:
+                session = self.session_class(self.serializer(app).loads(data),
+                                             sid=sid)
+                session.signed_at = total_seconds(timestamp - _epoch)
+                session.payload = data
+                return session
+        return self.session_class(sid=self.generate_sid(), new=True)
+
+    def save_session(self, cx, response):
+        if not cx.session_opened:
+            return
+        app = cx.app
+        cookie = self.get_cookie_template(app)
+        session = cx.session
+        if not session:
+            if session.modified:
+                if not session.new:
+                    self.store.delete(session.sid)
+                cookie.delete_cookie(response)
+            return
+
+        ttl = total_seconds(app.permanent_session_lifetime)
+        if session.modified:
+            data = self.serializer(app).dumps(dict(session))
+            if data == session.payload:
+                session.modified = False
+            else:
+                self.store.save(session.sid, data, ttl)
+        if not self.should_set_cookie(app, session):
+            return
+        if not session.modified:
+            self.store.touch(session.sid, ttl)
 
+        val = self.get_signer(app).sign(session.sid).decode('ascii')
+        cookie.set_cookie(response, val,
+                          self.get_expiration_time(app, session))
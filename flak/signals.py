@@ -6,6 +6,7 @@ def fake_namespace():
             return _FakeSignal(name, doc)
 
     class _FakeSignal(object):
+        has_receivers = False
         def __init__(self, name, doc=None):
             self.name = name
             self.__doc__ = doc
@@ -20,8 +21,46 @@ def fake_namespace():
         del _fail
     return Namespace
 
+def blinker_namespace():
+    from blinker import Namespace as BaseNamespace, NamedSignal
+
+    class Signal(NamedSignal):
+        # lets senders skip building the send() arguments when nobody
+        # listens, kept up to date on every (dis)connect
+        has_receivers = False
+
+        def _update_has_receivers(self):
+            self.has_receivers = any(list(self._by_sender.values()))
+
+        def connect(self, *args, **kwargs):
+            rv = NamedSignal.connect(self, *args, **kwargs)
+            # set afterwards, connect() can run weakref cleanups of other
+            # receivers that recompute the flag
+            self.has_receivers = True
+            return rv
+
+        def _disconnect(self, receiver_id, sender_id):
+            NamedSignal._disconnect(self, receiver_id, sender_id)
+            self._update_has_receivers()
+
+        def _cleanup_sender(self, sender_ref):
+            NamedSignal._cleanup_sender(self, sender_ref)
+            self._update_has_receivers()
+
+        def _clear_state(self):
+            NamedSignal._clear_state(self)
+            self.has_receivers = False
+
+    class Namespace(BaseNamespace):
+        def signal(self, name, doc=None):
+            try:
+                return self[name]
+            except KeyError:
+                return self.setdefault(name, Signal(name, doc))
+    return Namespace
+
 try:
-    from blinker import Namespace
+    Namespace = blinker_namespace()
 except ImportError:
     Namespace = fake_namespace()
 
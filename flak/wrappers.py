@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from werkzeug.wrappers import Request as BaseRequest, Response as BaseResponse
-from werkzeug.exceptions import BadRequest
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
 
 from . import json
 
@@ -15,6 +15,31 @@ def _get_data(req, cache):
     return req.data
 
 
+def _split_lines(stream, chunk_size, limit=None):
+    # reads `stream` in chunks and yields its lines without the newline,
+    # a line spanning chunks is joined once it is complete
+    pending = []
+    total = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if limit is not None and total > limit:
+            raise RequestEntityTooLarge()
+        lines = chunk.split(b'\n')
+        if len(lines) == 1:
+            pending.append(chunk)
+            continue
+        pending.append(lines[0])
+        yield b''.join(pending)
+        for line in lines[1:-1]:
+            yield line
+        pending = [lines[-1]]
+    if pending:
+        yield b''.join(pending)
+
+
 class Request(BaseRequest):
     url_rule = None
     view_args = None
@@ -57,6 +82,26 @@ class Request(BaseRequest):
             self._cached_json = rv
         return rv
 
+    def _iter_json_lines(self, cx, chunk_size=None):
+        limit = self.max_content_length
+        if (limit is not None and self.content_length is not None
+                and self.content_length > limit):
+            raise RequestEntityTooLarge()
+        lines = _split_lines(self._get_stream_for_parsing(),
+                             chunk_size or json.stream_chunk_size, limit)
+        return self._decode_lines(cx, lines)
+
+    def _decode_lines(self, cx, lines):
+        backend, decoder = json.get_decoder(cx.app)
+        charset = self.mimetype_params.get('charset')
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                yield backend.decode(decoder, line, charset)
+            except ValueError as e:
+                self.on_json_error(e)
+
     def on_json_error(self, e):
         if self.debug:
             raise BadRequest('Failed to decode JSON object: {0}'.format(e))
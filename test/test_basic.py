@@ -7,7 +7,8 @@ import time
 import pickle
 from datetime import datetime
 from threading import Thread
-from werkzeug.exceptions import BadRequest, NotFound, Forbidden
+from werkzeug.exceptions import (BadRequest, NotFound, Forbidden,
+                                 MethodNotAllowed)
 from werkzeug.http import parse_date
 from werkzeug.routing import BuildError
 import werkzeug.serving
@@ -60,6 +61,51 @@ def test_options_handling_disabled():
     assert sorted(rv.allow) == ['OPTIONS']
 
 
+def test_options_allow_set_is_cached():
+    app = Flak(__name__)
+
+    @app.route('/a', methods=['GET'])
+    def a(cx):
+        return 'a'
+
+    @app.route('/<name>', methods=['DELETE'])
+    def delete(cx, name):
+        return name
+
+    c = app.test_client()
+    rv = c.open('/a', method='OPTIONS')
+    assert sorted(rv.allow) == ['DELETE', 'GET', 'HEAD', 'OPTIONS']
+    rv = c.open('/b', method='OPTIONS')
+    assert sorted(rv.allow) == ['DELETE', 'OPTIONS']
+    assert app.url_matcher._allowed == {
+        u'|/a': frozenset(['DELETE', 'GET', 'HEAD', 'OPTIONS'])}
+    with app.test_context('/b') as cx:
+        rv = app.url_matcher.allowed_methods(cx.url_adapter)
+        assert rv is app.url_matcher.allowed_methods(cx.url_adapter)
+        assert rv == frozenset(['DELETE', 'OPTIONS'])
+    # the allow set is not mistaken for a match of another method
+    assert c.open('/b', method='--').status_code == 405
+
+
+def test_head_handler():
+    app = Flak(__name__)
+
+    @app.route('/file/<name>')
+    def download(cx, name):
+        return 'contents of ' + name
+
+    @app.head_handler('download')
+    def download_head(cx, name):
+        return '', {'X-Name': name}
+
+    c = app.test_client()
+    rv = c.head('/file/x')
+    assert rv.status_code == 200
+    assert rv.headers['X-Name'] == 'x'
+    assert rv.data == b''
+    assert c.get('/file/x').data == b'contents of x'
+
+
 def test_request_dispatching():
     app = Flak(__name__)
 
@@ -194,6 +240,185 @@ def test_session():
     assert c.get('/get').data == b'42'
 
 
+def test_session_is_opened_lazily():
+    from flak.sessions import SecureCookieSessionInterface
+    app = Flak(__name__)
+    app.secret_key = 'testkey'
+    app.config['SESSION_REFRESH_EACH_REQUEST'] = True
+    opened = []
+
+    class Interface(SecureCookieSessionInterface):
+        def open_session(self, cx):
+            opened.append(cx.request.path)
+            return super(Interface, self).open_session(cx)
+
+    app.session_interface = Interface()
+
+    @app.route('/set')
+    def set(cx):
+        cx.session.permanent = True
+        cx.session['value'] = 42
+        return 'set'
+
+    @app.route('/health')
+    def health(cx):
+        assert not cx.session_opened
+        return 'ok'
+
+    c = app.test_client()
+    assert 'set-cookie' in c.get('/set').headers
+    rv = c.get('/health')
+    assert rv.data == b'ok'
+    assert 'set-cookie' not in rv.headers
+    assert opened == ['/set']
+
+
+def test_session_signing_serializer_is_cached():
+    app = Flak(__name__)
+    app.secret_key = 'one'
+
+    @app.route('/set')
+    def set(cx):
+        cx.session['value'] = 42
+        return 'set'
+
+    @app.route('/get')
+    def get(cx):
+        return str(cx.session.get('value'))
+
+    interface = app.session_interface
+    with app.test_context() as cx:
+        s = interface.get_signing_serializer(cx)
+        assert interface.get_signing_serializer(cx) is s
+        app.secret_key = 'two'
+        assert interface.get_signing_serializer(cx) is not s
+        app.secret_key = 'one'
+
+    c = app.test_client()
+    c.get('/set')
+    assert c.get('/get').data == b'42'
+    app.secret_key = 'two'
+    assert c.get('/get').data == b'None'
+
+
+def test_session_key_is_derived_once(monkeypatch):
+    from itsdangerous import TimestampSigner
+    app = Flak(__name__)
+    app.secret_key = 'testkey'
+    app.config['SESSION_COOKIE_CACHE_SIZE'] = 0
+    derived = []
+    derive_key = TimestampSigner.derive_key
+
+    def counting_derive_key(self):
+        derived.append(self.salt)
+        return derive_key(self)
+
+    monkeypatch.setattr(TimestampSigner, 'derive_key', counting_derive_key)
+
+    @app.route('/set')
+    def set(cx):
+        cx.session['value'] = 42
+        return 'set'
+
+    @app.route('/get')
+    def get(cx):
+        return str(cx.session['value'])
+
+    c = app.test_client()
+    c.get('/set')
+    for i in range(5):
+        assert c.get('/get').data == b'42'
+    assert len(derived) == 1
+
+
+def test_session_interface_subclass_without_super_init():
+    from flak.sessions import SecureCookieSessionInterface
+    app = Flak(__name__)
+    app.secret_key = 'testkey'
+
+    class Interface(SecureCookieSessionInterface):
+        def __init__(self):
+            pass
+
+    app.session_interface = Interface()
+
+    @app.route('/set')
+    def set(cx):
+        cx.session['value'] = 42
+        return 'set'
+
+    @app.route('/get')
+    def get(cx):
+        return str(cx.session['value'])
+
+    c = app.test_client()
+    c.get('/set')
+    assert c.get('/get').data == b'42'
+
+
+def test_session_cookie_cache(monkeypatch):
+    app = Flak(__name__)
+    app.secret_key = 'testkey'
+    app.config['SESSION_COOKIE_CACHE_SIZE'] = 10
+    app.config['PERMANENT_SESSION_LIFETIME'] = 60
+
+    @app.route('/set')
+    def set(cx):
+        cx.session['items'] = [1]
+        return 'set'
+
+    @app.route('/get')
+    def get(cx):
+        items = cx.session.get('items', [])
+        items.append(2)
+        return repr(len(items))
+
+    c = app.test_client()
+    c.get('/set')
+    # the view mutates its copy, the cached payload stays the same
+    assert c.get('/get').data == b'2'
+    assert c.get('/get').data == b'2'
+    cache = app.session_interface.get_cookie_cache(app)
+    assert len(cache) == 1
+    assert cache.hits == 1
+    assert cache.hit_rate == 0.5
+
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 120)
+    assert c.get('/get').data == b'1'
+    assert len(cache) == 0
+
+    app.config['SESSION_COOKIE_CACHE_SIZE'] = 0
+    assert app.session_interface.get_cookie_cache(app) is None
+
+
+def test_session_refresh_fraction(monkeypatch):
+    app = Flak(__name__)
+    app.secret_key = 'testkey'
+    app.config['PERMANENT_SESSION_LIFETIME'] = 100
+    app.config['SESSION_REFRESH_FRACTION'] = 0.5
+
+    @app.route('/login')
+    def login(cx):
+        cx.session.permanent = True
+        cx.session['user'] = 'alice'
+        return 'ok'
+
+    @app.route('/')
+    def index(cx):
+        # writing the same value again is not a modification
+        cx.session['user'] = 'alice'
+        return 'ok'
+
+    c = app.test_client()
+    assert 'set-cookie' in c.get('/login').headers
+    assert 'set-cookie' not in c.get('/').headers
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 60)
+    assert 'set-cookie' in c.get('/').headers
+    assert 'set-cookie' not in c.get('/').headers
+
+
 def test_session_using_server_name():
     app = Flak(__name__)
     app.config.update(
@@ -748,6 +973,98 @@ def test_trapping_of_all_http_exceptions():
         c.get('/fail')
 
 
+def test_abort_returns_response():
+    app = Flak(__name__)
+
+    @app.errorhandler(403)
+    def forbidden(cx, e):
+        return 'forbidden: ' + e.description, 403
+
+    @app.route('/gone')
+    def gone(cx):
+        return cx.abort(410)
+
+    @app.route('/forbidden')
+    def forbidden_view(cx):
+        return cx.abort(403, 'nope')
+
+    c = app.test_client()
+    rv = c.get('/gone')
+    assert rv.status_code == 410
+    assert rv.mimetype == 'text/html'
+    assert b'<title>410 Gone</title>' in rv.data
+    rv = c.get('/forbidden')
+    assert rv.status_code == 403
+    assert rv.data == b'forbidden: nope'
+    with app.test_context() as cx:
+        with pytest.raises(LookupError):
+            cx.abort(999)
+        app.config['TRAP_HTTP_EXCEPTIONS'] = True
+        with pytest.raises(NotFound):
+            cx.abort(404)
+
+
+def test_error_response_with_unhashable_description():
+    app = Flak(__name__)
+
+    @app.route('/')
+    def index(cx):
+        raise BadRequest(['a', 'b'])
+
+    for i in range(2):
+        rv = app.test_client().get('/')
+        assert rv.status_code == 400
+        assert b"['a', 'b']" in rv.data
+
+
+def test_routing_errors_are_not_raised():
+    app = Flak(__name__)
+    raised = []
+
+    @app.route('/', methods=['POST'])
+    def index(cx):
+        return 'index'
+
+    orig_raise = app.raise_routing_exception
+
+    def raise_routing_exception(rq):
+        raised.append(rq.routing_exception)
+        orig_raise(rq)
+
+    c = app.test_client()
+    rv = c.get('/missing')
+    assert rv.status_code == 404
+    assert b'<title>404 Not Found</title>' in rv.data
+    assert c.get('/missing').data == rv.data
+    rv = c.get('/')
+    assert rv.status_code == 405
+    assert sorted(rv.allow) == ['OPTIONS', 'POST']
+    assert sorted(app._error_bodies) == [
+        (404, 'Not Found', NotFound.description),
+        (405, 'Method Not Allowed', MethodNotAllowed.description)]
+
+    # once something could look at the exception it is raised again
+    app.raise_routing_exception = raise_routing_exception
+    assert c.get('/missing').status_code == 404
+    assert len(raised) == 1
+
+
+def test_handle_http_exception_returns_unhandled_exceptions():
+    app = Flak(__name__)
+
+    @app.route('/forbidden')
+    def forbidden(cx):
+        flak.abort(403)
+
+    with app.test_context() as cx:
+        e = Forbidden()
+        assert app.handle_http_exception(cx, e) is e
+    rv = app.test_client().get('/forbidden')
+    assert rv.status_code == 403
+    assert b'<title>403 Forbidden</title>' in rv.data
+    assert (403, 'Forbidden', Forbidden.description) in app._error_bodies
+
+
 def test_enctype_debug_helper():
     from flak.debughelpers import DebugFilesKeyError
     app = Flak(__name__)
@@ -1338,3 +1655,75 @@ def test_run_server_port(monkeypatch):
     app.run(hostname, port, debug=True)
     assert rv['result'] == 'running on %s:%s ...' % (hostname, port)
 
+
+def test_setup_methods_raise_after_first_request():
+    app = Flak(__name__)
+
+    @app.route('/')
+    def index(cx):
+        return 'index'
+
+    assert not app.frozen
+    assert app.test_client().get('/').data == b'index'
+    assert app.frozen
+
+    with pytest.raises(AssertionError):
+        @app.route('/late')
+        def late(cx):
+            return 'late'
+    with pytest.raises(AssertionError):
+        app.before_request(lambda cx: None)
+    with pytest.raises(AssertionError):
+        app.errorhandler(404)(lambda cx, e: 'not found')
+
+
+def test_freeze():
+    app = Flak(__name__)
+    called = []
+
+    @app.before_request
+    def before(cx):
+        called.append('before')
+
+    @app.after_request
+    def after1(cx, response):
+        called.append('after1')
+        return response
+
+    @app.after_request
+    def after2(cx, response):
+        called.append('after2')
+        return response
+
+    @app.route('/')
+    def index(cx):
+        return 'index'
+
+    app.freeze()
+    app.freeze()
+    assert app.before_request_funcs == (before,)
+    assert app.after_request_funcs == (after1, after2)
+    assert app.teardown_funcs == ()
+    assert app.test_client().get('/').data == b'index'
+    assert called == ['before', 'after2', 'after1']
+
+
+def test_frozen_pipeline_calls_overridden_stages():
+    called = []
+
+    class MyFlak(Flak):
+        def preprocess_request(self, cx):
+            called.append('preprocess')
+
+        def process_response(self, cx, response):
+            called.append('process')
+            return response
+
+    app = MyFlak(__name__)
+
+    @app.route('/')
+    def index(cx):
+        return 'index'
+
+    assert app.test_client().get('/').data == b'index'
+    assert called == ['preprocess', 'process']
@@ -180,3 +180,30 @@ def test_get_namespace():
     assert 2 == len(bar_options)
     assert 'bar stuff 1' == bar_options['BAR_STUFF_1']
     assert 'bar stuff 2' == bar_options['BAR_STUFF_2']
+
+
+def test_config_generation():
+    app = Flak(__name__)
+    config = app.config
+    seen = [config.generation]
+
+    def changed():
+        assert config.generation != seen[-1]
+        seen.append(config.generation)
+
+    config['FOO'] = 1
+    changed()
+    config.update(BAR=2)
+    changed()
+    config.from_mapping(BAZ=3)
+    changed()
+    config.setdefault('FOO', 4)
+    assert config.generation == seen[-1]
+    config.setdefault('QUX', 5)
+    changed()
+    del config['QUX']
+    changed()
+    config.pop('BAZ')
+    changed()
+    assert config['FOO'] == 1
+    assert config.generation == seen[-1]
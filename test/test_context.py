@@ -17,6 +17,40 @@ def test_basic_url_generation():
         rv = cx.url_for('index')
         assert rv == 'https://localhost/'
 
+def test_url_adapter_is_bound_once():
+    app = Flak(__name__)
+
+    @app.route('/')
+    def index(cx):
+        assert cx.url_adapter is cx.url_adapter
+        return cx.url_for('index')
+
+    assert app.test_client().get('/').data == b'/'
+
+    app.config['SERVER_NAME'] = 'localhost'
+    with app.new_context() as cx1:
+        with app.new_context() as cx2:
+            assert cx1.url_adapter is cx2.url_adapter
+
+    app.config['PREFERRED_URL_SCHEME'] = 'https'
+    with app.new_context() as cx3:
+        assert cx3.url_adapter is not cx1.url_adapter
+        assert cx3.url_for('index') == 'https://localhost/'
+
+def test_url_generation_scheme_does_not_stick():
+    app = Flak(__name__)
+    app.config['SERVER_NAME'] = 'localhost'
+
+    @app.route('/')
+    def index(cx):
+        pass
+
+    with app.new_context() as cx:
+        assert cx.url_for('index', _scheme='https') == 'https://localhost/'
+        assert cx.url_for('index') == 'http://localhost/'
+    with app.new_context() as cx:
+        assert cx.url_for('index') == 'http://localhost/'
+
 def test_url_generation_requires_server_name():
     app = Flak(__name__)
     with app.new_context() as cx:
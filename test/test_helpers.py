@@ -33,6 +33,9 @@ class TestJSON(object):
             url = '/datetest{0}'.format(i)
             f = lambda cx, val=d: cx.jsonify(x=val)
             app.add_url_rule(url, f, str(i))
+
+        for i, d in enumerate(test_dates):
+            url = '/datetest{0}'.format(i)
             rv = c.get(url)
             assert rv.mimetype == 'application/json'
             assert json.loads(rv.data)['x'] == http_date(d.timetuple())
@@ -380,6 +383,87 @@ class TestLogging(object):
             assert cx.url_for('myview', _method='POST') == '/myview/create'
 
 
+class TestURLBuildCache(object):
+
+    def make_app(self):
+        app = Flak(__name__)
+        app.config['URL_BUILD_CACHE_SIZE'] = 16
+        @app.route('/item/<int:id>')
+        def item(cx, id):
+            return cx.url_for('item', id=id, _anchor='top')
+        return app
+
+    def test_cache_disabled_by_default(self):
+        app = Flak(__name__)
+        assert app.url_build_cache is None
+
+    def test_cached_builds(self):
+        app = self.make_app()
+        c = app.test_client()
+        assert c.get('/item/1').data == b'/item/1#top'
+        assert c.get('/item/1').data == b'/item/1#top'
+        assert c.get('/item/2').data == b'/item/2#top'
+        cache = app.url_build_cache
+        assert (cache.hits, cache.misses) == (1, 2)
+
+        with app.test_context() as cx:
+            assert cx.url_for('item', id=1, _external=True) == \
+                'http://localhost/item/1'
+            assert cx.url_for('item', id=1, _external=True,
+                              _scheme='https') == 'https://localhost/item/1'
+            assert cx.url_for('item', id=1, q=['a', 'b']) == \
+                '/item/1?q=a&q=b'
+        assert cache.hits == 1
+
+    def test_equal_values_of_other_types(self):
+        app = self.make_app()
+        @app.route('/p')
+        def p(cx):
+            return ''
+        with app.test_context() as cx:
+            for i in range(2):
+                assert cx.url_for('p', x=1) == '/p?x=1'
+                assert cx.url_for('p', x=True) == '/p?x=True'
+                assert cx.url_for('p', x=1.0) == '/p?x=1.0'
+
+    def test_argument_order_is_kept(self):
+        app = self.make_app()
+        @app.route('/p')
+        def p(cx):
+            return ''
+        with app.test_context() as cx:
+            assert cx.url_for('p', a=1, b=2) == '/p?a=1&b=2'
+            assert cx.url_for('p', b=2, a=1) == '/p?b=2&a=1'
+        app.url_map.sort_parameters = True
+        with app.test_context() as cx:
+            assert cx.url_for('p', b=2, a=1) == '/p?a=1&b=2'
+            assert cx.url_for('p', a=1, b=2) == '/p?a=1&b=2'
+
+    def test_impure_url_defaults_bypass_cache(self):
+        app = self.make_app()
+        @app.url_defaults
+        def add_id(cx, endpoint, values):
+            values.setdefault('id', cx.globals.id)
+        with app.test_context() as cx:
+            for i in range(3):
+                cx.globals.id = i
+                assert cx.url_for('item') == '/item/%d' % i
+        assert len(app.url_build_cache) == 0
+
+    def test_pure_url_defaults_are_cached(self):
+        app = self.make_app()
+        calls = []
+        @app.url_defaults
+        def add_id(cx, endpoint, values):
+            calls.append(endpoint)
+            values.setdefault('id', 42)
+        add_id.pure = True
+        with app.test_context() as cx:
+            assert cx.url_for('item') == '/item/42'
+            assert cx.url_for('item') == '/item/42'
+        assert calls == ['item']
+
+
 class TestNoImports(object):
     """Test Flaks are created without import.
 
@@ -493,3 +577,25 @@ class TestStreaming(object):
         assert rv.data == b'123'
         assert called == ['gen.close', 'cx.close']
 
+    def test_streaming_head_closes_without_iterating(self):
+        app = Flak(__name__)
+        called = []
+
+        @app.route('/')
+        def index(cx):
+            @cx.before_close
+            def onclose(exc):
+                called.append('cx.close')
+
+            @cx.streaming
+            def generate():
+                called.append('generate')
+                yield 'body'
+            return flak.Response(generate())
+
+        # servers close the app iterator, a buffered client does too
+        rv = app.test_client().head('/', buffered=True)
+        assert rv.status_code == 200
+        assert rv.data == b''
+        assert called == ['cx.close']
+
@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+
+import io
+import uuid
+import datetime
+import pytest
+from werkzeug.http import http_date
+from flak import Flak, json
+from flak._compat import text_type
+
+
+@pytest.fixture(params=[None] + sorted(json.backends))
+def app(request):
+    app = Flak(__name__)
+    app.config['JSON_BACKEND'] = request.param
+    try:
+        app.json_backend
+    except ImportError:
+        pytest.skip('%s is not installed' % request.param)
+    return app
+
+
+class HTML(object):
+    def __html__(self):
+        return u'<p>snowman \N{SNOWMAN}</p>'
+
+
+def test_backend_is_selected_by_config():
+    app = Flak(__name__)
+    assert app.json_backend is json.default_backend
+    app.config['JSON_BACKEND'] = 'stdlib'
+    import json as stdlib
+    assert app.json_backend.module is stdlib
+    assert app.json_backend is app.json_backend
+    app.config['JSON_BACKEND'] = 'missing'
+    with pytest.raises(LookupError):
+        app.json_backend
+    app.json_backends['missing'] = lambda: json.default_backend
+    assert app.json_backend is json.default_backend
+
+
+def test_special_types(app):
+    d = datetime.datetime(1973, 3, 11, 6, 30, 45)
+    u = uuid.UUID('6ba7b810-9dad-11d1-80b4-00c04fd430c8')
+    with app.new_context() as cx:
+        rv = cx.loads(cx.dumps([d, d.date(), u, HTML()]))
+    assert rv == [http_date(d.timetuple()), http_date(d.date().timetuple()),
+                  str(u), u'<p>snowman \N{SNOWMAN}</p>']
+
+
+def test_ensure_ascii(app):
+    with app.new_context() as cx:
+        assert cx.dumps(u'\N{SNOWMAN}') == '"\\u2603"'
+        app.config['JSON_AS_ASCII'] = False
+        assert cx.dumps(u'\N{SNOWMAN}') == u'"☃"'
+        assert cx.dumps(u'\N{SNOWMAN}', encoding='utf-8') == \
+            u'"☃"'.encode('utf-8')
+
+
+def test_sort_keys(app):
+    keys = ['b', 'a', 'd', 'c']
+    data = dict((k, i) for i, k in enumerate(keys))
+    with app.new_context() as cx:
+        rv = cx.dumps(data)
+        assert [rv.index('"%s"' % k) for k in sorted(keys)] == \
+            sorted(rv.index('"%s"' % k) for k in keys)
+        assert cx.loads(rv) == data
+
+
+def test_jsonify_returns_bytes(app):
+    app.config['JSON_AS_ASCII'] = False
+
+    @app.route('/')
+    def index(cx):
+        return cx.jsonify(snowman=u'\N{SNOWMAN}', n=[1, 2.5, None, True])
+
+    for pretty in True, False:
+        app.config['JSONIFY_PRETTYPRINT_REGULAR'] = pretty
+        rv = app.test_client().get('/')
+        assert rv.mimetype == 'application/json'
+        assert rv.data.endswith(b'\n')
+        assert (b'\n  "' in rv.data) == pretty
+        assert u'\N{SNOWMAN}'.encode('utf-8') in rv.data
+        with app.new_context() as cx:
+            assert cx.loads(rv.data) == {'snowman': u'\N{SNOWMAN}',
+                                         'n': [1, 2.5, None, True]}
+
+
+def test_large_integers(app):
+    with app.new_context() as cx:
+        assert cx.loads(cx.dumps({'n': 2 ** 70})) == {'n': 2 ** 70}
+
+
+def test_non_finite_floats(app):
+    orjson = isinstance(app.json_backend, json.ORJSONBackend)
+    for n in float('nan'), float('inf'):
+        with app.new_context() as cx:
+            try:
+                rv = cx.dumps({'n': [n]})
+            except ValueError:
+                # newer simplejson doesn't allow nan by default
+                assert not orjson
+                continue
+        if orjson:
+            # a documented difference
+            assert rv == '{"n":[null]}'
+        else:
+            assert 'NaN' in rv or 'Infinity' in rv
+
+
+def test_enums(app):
+    enum = pytest.importorskip('enum')
+
+    class Color(enum.Enum):
+        red = 1
+
+    if isinstance(app.json_backend, json.ORJSONBackend):
+        # a documented difference
+        with app.new_context() as cx:
+            assert cx.dumps([Color.red]) == '[1]'
+        return
+
+    with app.new_context() as cx:
+        with pytest.raises(TypeError):
+            cx.dumps([Color.red])
+        with pytest.raises(TypeError):
+            cx.dumps({'c': {'d': Color.red}})
+
+    @app.json_serializer(Color)
+    def serialize_color(o):
+        return o.name
+
+    with app.new_context() as cx:
+        assert cx.loads(cx.dumps([Color.red])) == ['red']
+
+
+def test_get_json(app):
+    @app.route('/', methods=['POST'])
+    def index(cx):
+        return text_type(cx.get_json()['x'])
+
+    c = app.test_client()
+    rv = c.post('/', data=u'{"x": "€"}'.encode('iso-8859-15'),
+                content_type='application/json; charset=iso-8859-15')
+    assert rv.data == u'€'.encode('utf-8')
+    rv = c.post('/', data=b'{"x": [', content_type='application/json')
+    assert rv.status_code == 400
+
+
+def test_custom_encoder_and_decoder(app):
+    class X(object):
+        pass
+
+    class Encoder(json.JSONEncoder):
+        def default(self, o):
+            if isinstance(o, X):
+                return 'x'
+            return json.JSONEncoder.default(self, o)
+
+    class Decoder(json.JSONDecoder):
+        def __init__(self, *args, **kwargs):
+            kwargs.setdefault('object_hook', lambda o: sorted(o))
+            json.JSONDecoder.__init__(self, *args, **kwargs)
+
+    app.json_encoder = Encoder
+    app.json_decoder = Decoder
+    with app.new_context() as cx:
+        assert cx.dumps([X()]) == '["x"]'
+        assert cx.loads('{"b": 1, "a": 2}') == ['a', 'b']
+        with pytest.raises(TypeError):
+            cx.dumps(object())
+
+
+def test_files(app):
+    with app.new_context() as cx:
+        out = io.BytesIO()
+        cx.dump({'a': u'\N{SNOWMAN}'}, out, encoding='utf-8')
+        out.seek(0)
+        assert cx.load(out) == {'a': u'\N{SNOWMAN}'}
+
+
+def test_sessions(app):
+    app.secret_key = 'testkey'
+
+    @app.route('/set')
+    def set(cx):
+        cx.session['value'] = [datetime.datetime(2020, 1, 2), u'\N{SNOWMAN}']
+        return ''
+
+    @app.route('/get')
+    def get(cx):
+        return cx.jsonify(value=cx.session['value'])
+
+    c = app.test_client()
+    c.get('/set')
+    with app.new_context() as cx:
+        assert cx.loads(c.get('/get').data)['value'] == \
+            [http_date(datetime.datetime(2020, 1, 2)), u'\N{SNOWMAN}']
+
+
+def test_encoders_are_reused(app):
+    backend, encoder = json.get_encoder(app, indent=2)
+    assert json.get_encoder(app, indent=2) == (backend, encoder)
+    assert json.get_encoder(app)[1] is not encoder
+    decoder = json.get_decoder(app)[1]
+    assert json.get_decoder(app)[1] is decoder
+
+    app.config['JSON_SORT_KEYS'] = False
+    assert json.get_encoder(app, indent=2)[1] is not encoder
+    encoder = json.get_encoder(app, indent=2)[1]
+
+    class Encoder(json.JSONEncoder):
+        pass
+    app.json_encoder = Encoder
+    assert json.get_encoder(app, indent=2)[1] is not encoder
+
+    # options that can't be hashed still work
+    with app.new_context() as cx:
+        assert cx.dumps({'a': 1}, separators=[',', ':']) == '{"a":1}'
+
+
+def test_json_serializer_registry(app):
+    import fractions
+
+    class Point(object):
+        def __init__(self, x, y):
+            self.x, self.y = x, y
+
+    class Point3(Point):
+        pass
+
+    @app.json_serializer(fractions.Fraction)
+    def serialize_fraction(o):
+        return str(o)
+
+    @app.json_serializer(Point)
+    def serialize_point(o):
+        return [o.x, o.y]
+
+    @app.json_serializer(uuid.UUID)
+    def serialize_uuid(o):
+        return o.hex
+
+    u = uuid.UUID('6ba7b810-9dad-11d1-80b4-00c04fd430c8')
+    with app.new_context() as cx:
+        rv = cx.loads(cx.dumps([fractions.Fraction(1, 3), Point(1, 2),
+                                Point3(3, 4), u, HTML()]))
+        assert rv == ['1/3', [1, 2], [3, 4], u.hex,
+                      u'<p>snowman \N{SNOWMAN}</p>']
+    assert app.json_types.resolve(Point3) is serialize_point
+    assert app.json_types.resolve(object) is None
+    # registrations are per app
+    other = Flak(__name__)
+    assert other.json_types.resolve(Point) is None
+    assert other.json_types.resolve(uuid.UUID) is str
+
+
+def test_json_serializer_for_decimal(app):
+    import decimal
+    with app.new_context() as cx:
+        # encoders made before the registration are replaced
+        cx.dumps([1])
+
+    @app.json_serializer(decimal.Decimal)
+    def serialize_decimal(o):
+        return 'DEC'
+
+    with app.new_context() as cx:
+        assert cx.loads(cx.dumps([decimal.Decimal('1.5')])) == ['DEC']
+
+
+def test_json_serializer_rejects_native_types(app):
+    from collections import namedtuple
+    Pair = namedtuple('Pair', 'x y')
+
+    with pytest.raises(TypeError):
+        app.json_serializer(Pair)(lambda o: 'NT')
+    with pytest.raises(TypeError):
+        app.json_serializer(bool)(str)
+    assert app.json_types.resolve(Pair) is None
+
+
+def test_json_serializer_in_sessions(app):
+    import fractions
+    from flak.sessions import (SecureCookieSessionInterface,
+                               CompactSessionSerializer)
+
+    class Compact(SecureCookieSessionInterface):
+        serializer = CompactSessionSerializer
+
+    app.secret_key = 'testkey'
+    app.json_serializer(fractions.Fraction)(str)
+
+    @app.route('/set')
+    def set(cx):
+        cx.session['value'] = fractions.Fraction(1, 3)
+        return ''
+
+    @app.route('/get')
+    def get(cx):
+        return cx.session['value']
+
+    for interface in SecureCookieSessionInterface(), Compact():
+        app.session_interface = interface
+        c = app.test_client()
+        c.get('/set')
+        assert c.get('/get').data == b'1/3'
+
+
+def test_jsonify_stream(app):
+    closed = []
+
+    def records(n):
+        try:
+            for i in range(n):
+                yield {'id': i, 'name': u'\N{SNOWMAN}', 'at': uuid.UUID(int=i)}
+        finally:
+            closed.append(n)
+
+    @app.route('/array/<int:n>')
+    def array(cx, n):
+        @cx.before_close
+        def close(exc):
+            closed.append('cx')
+        return cx.jsonify_stream(records(n), chunk_size=100)
+
+    @app.route('/object')
+    def obj(cx):
+        return cx.jsonify_stream([('b', 1), ('a', [HTML()])], pairs=True)
+
+    @app.route('/mapping')
+    def mapping(cx):
+        return cx.jsonify_stream({'a': datetime.date(1975, 1, 5)}, pairs=True)
+
+    c = app.test_client()
+    with app.new_context() as cx:
+        for n in 0, 1, 50:
+            rv = c.get('/array/%d' % n)
+            data = rv.data
+            assert closed[-2:] == [n, 'cx']
+            assert rv.mimetype == 'application/json'
+            assert data.endswith(b']\n')
+            assert cx.loads(data) == cx.loads(cx.dumps(list(records(n))))
+        assert c.get('/object').data == \
+            b'{"b":1,"a":["<p>snowman \\u2603</p>"]}\n'
+        assert cx.loads(c.get('/mapping').data) == \
+            {'a': http_date(datetime.date(1975, 1, 5).timetuple())}
+
+
+def test_jsonify_stream_coalesces_chunks(app):
+    @app.route('/<int:size>')
+    def index(cx, size):
+        return cx.jsonify_stream(range(1000), chunk_size=size)
+
+    c = app.test_client()
+    rv = c.get('/100000', buffered=False)
+    chunks = list(rv.response)
+    assert len(chunks) == 1
+    rv = c.get('/100', buffered=False)
+    chunks = list(rv.response)
+    assert len(chunks) > 10
+    assert all(len(chunk) >= 100 for chunk in chunks[:-1])
+    expected = ','.join(map(str, range(1000))).encode('ascii')
+    assert b''.join(chunks) == b'[' + expected + b']\n'
+
+
+def test_jsonify_stream_rejects_non_string_keys(app):
+    errors = []
+
+    @app.route('/')
+    def index(cx):
+        @cx.before_close
+        def close(exc):
+            errors.append(exc)
+        return cx.jsonify_stream([('a', 1), (2, 3)], pairs=True)
+
+    assert not app.test_client().get('/').data.endswith(b'}\n')
+    assert isinstance(errors[0], TypeError)
+
+
+def test_iter_json_lines(app):
+    app.config['MAX_CONTENT_LENGTH'] = 1000
+
+    @app.route('/', methods=['POST'])
+    def index(cx):
+        return cx.jsonify(records=list(cx.iter_json_lines(chunk_size=7)))
+
+    c = app.test_client()
+    body = u'{"a": 1}\n\n[1, 2, "€"]\r\n"x"\n{"long": "%s"}' % ('y' * 50)
+    rv = c.post('/', data=body.encode('utf-8'),
+                content_type='application/x-ndjson')
+    with app.new_context() as cx:
+        assert cx.loads(rv.data)['records'] == \
+            [{'a': 1}, [1, 2, u'€'], 'x', {'long': 'y' * 50}]
+    assert c.post('/', data=b'{"a": 1}\n{"a"\n').status_code == 400
+    assert c.post('/', data=b'1\n' * 501).status_code == 413
+
+    # bodies of unknown length are counted while they are read
+    from werkzeug.test import EnvironBuilder, run_wsgi_app
+    for lines, status in ((400, '200 OK'),
+                          (501, '413 REQUEST ENTITY TOO LARGE')):
+        environ = EnvironBuilder(method='POST',
+                                 data=b'1\n' * lines).get_environ()
+        del environ['CONTENT_LENGTH']
+        environ['wsgi.input_terminated'] = True
+        assert run_wsgi_app(app, environ)[1] == status
+
+
+def test_ndjson_response(app):
+    closed = []
+
+    def records():
+        try:
+            yield {'a': u'line\nbreak'}
+            yield [datetime.date(1975, 1, 5)]
+            yield HTML()
+        finally:
+            closed.append(True)
+
+    @app.route('/')
+    def index(cx):
+        return cx.ndjson_response(records())
+
+    rv = app.test_client().get('/')
+    lines = rv.data.split(b'\n')
+    assert rv.mimetype == 'application/x-ndjson'
+    assert closed == [True]
+    assert lines[-1] == b''
+    with app.new_context() as cx:
+        assert [cx.loads(line) for line in lines[:-1]] == \
+            [{'a': u'line\nbreak'},
+             [http_date(datetime.date(1975, 1, 5).timetuple())],
+             u'<p>snowman \N{SNOWMAN}</p>']
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from werkzeug.routing import BaseConverter, RequestRedirect
+from flak import Flak
+from flak.helpers import LRUCache
+
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert 'b' not in cache
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert len(cache) == 2
+    assert cache.hits == 3
+    assert cache.misses == 1
+    assert cache.hit_rate == 0.75
+    assert cache.pop('a') == 1
+    assert len(cache) == 1
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.hits == cache.misses == 0
+
+
+def test_static_routes_skip_werkzeug_matching():
+    app = Flak(__name__)
+
+    @app.route('/')
+    def index(cx):
+        return 'index'
+
+    @app.route('/about/')
+    def about(cx):
+        return 'about'
+
+    c = app.test_client()
+    assert c.get('/').data == b'index'
+    assert c.get('/about/').data == b'about'
+    # strict slashes redirect still comes from werkzeug
+    rv = c.get('/about')
+    assert rv.status_code == RequestRedirect.code
+    assert rv.headers['Location'] == 'http://localhost/about/'
+    assert len(app.url_matcher.cache) == 0
+
+
+def test_dynamic_matches_are_cached():
+    app = Flak(__name__)
+
+    @app.route('/user/<int:id>')
+    def user(cx, id):
+        return 'user %d' % id
+
+    c = app.test_client()
+    assert c.get('/user/1').data == b'user 1'
+    assert c.get('/user/1').data == b'user 1'
+    assert c.get('/user/2').data == b'user 2'
+    cache = app.url_matcher.cache
+    assert len(cache) == 2
+    assert cache.hits == 1
+
+
+def test_view_args_are_not_shared():
+    app = Flak(__name__)
+
+    @app.url_value_preprocessor
+    def pop_lang(cx, endpoint, values):
+        cx.lang = values.pop('lang')
+
+    @app.route('/<lang>/page/<name>')
+    def page(cx, name):
+        return '%s %s' % (cx.lang, name)
+
+    c = app.test_client()
+    assert c.get('/de/page/x').data == b'de x'
+    assert c.get('/de/page/x').data == b'de x'
+
+
+def test_mutable_converter_values_are_not_cached():
+    class ListConverter(BaseConverter):
+        def to_python(self, value):
+            return value.split(',')
+
+    app = Flak(__name__)
+    app.url_map.converters['list'] = ListConverter
+
+    @app.route('/<list:args>')
+    def index(cx, args):
+        args.append('x')
+        return '|'.join(args)
+
+    c = app.test_client()
+    assert c.get('/1,2').data == b'1|2|x'
+    assert c.get('/1,2').data == b'1|2|x'
+    assert len(app.url_matcher.cache) == 0
+
+
+def test_custom_converters_are_not_cached():
+    from werkzeug.routing import ValidationError
+    objects = {'a': 'object a'}
+
+    class ObjectConverter(BaseConverter):
+        def to_python(self, value):
+            if value not in objects:
+                raise ValidationError()
+            return objects[value]
+
+    app = Flak(__name__)
+    app.url_map.converters['object'] = ObjectConverter
+
+    @app.route('/<object:obj>')
+    def show(cx, obj):
+        return obj
+
+    @app.route('/<name>', methods=['POST'])
+    def post(cx, name):
+        return name
+
+    c = app.test_client()
+    assert c.get('/a').data == b'object a'
+    assert sorted(c.open('/a', method='OPTIONS').allow) == \
+        ['GET', 'HEAD', 'OPTIONS', 'POST']
+    del objects['a']
+    assert c.get('/a').status_code == 405
+    assert sorted(c.open('/a', method='OPTIONS').allow) == \
+        ['OPTIONS', 'POST']
+    assert len(app.url_matcher.cache) == 0
+
+
+def test_matcher_refreshes_on_new_rules():
+    app = Flak(__name__)
+
+    @app.route('/<name>', methods=['POST'])
+    def post_any(cx, name):
+        return 'post ' + name
+
+    with app.test_context('/foo', method='POST') as cx:
+        assert cx.request.endpoint == 'post_any'
+    with app.test_context('/foo') as cx:
+        assert cx.request.routing_exception.code == 405
+
+    @app.route('/foo')
+    def foo(cx):
+        return 'foo'
+
+    c = app.test_client()
+    assert c.get('/foo').data == b'foo'
+    assert c.post('/foo').data == b'post foo'
+    rv = c.put('/foo')
+    assert rv.status_code == 405
+    assert sorted(rv.allow) == ['GET', 'HEAD', 'OPTIONS', 'POST']
+
+
+def test_redirect_rules_fall_back_to_werkzeug():
+    app = Flak(__name__)
+    app.add_url_rule('/old', None, 'old', redirect_to='/new')
+
+    @app.route('/new')
+    def new(cx):
+        return 'new'
+
+    c = app.test_client()
+    rv = c.get('/old')
+    assert rv.status_code == RequestRedirect.code
+    assert rv.headers['Location'] == 'http://localhost/new'
+    assert c.get('/new').data == b'new'
+
+
+def test_match_cache_can_be_disabled():
+    app = Flak(__name__)
+    app.config['URL_MATCH_CACHE_SIZE'] = 0
+
+    @app.route('/<int:id>')
+    def index(cx, id):
+        return str(id)
+
+    c = app.test_client()
+    assert c.get('/3').data == b'3'
+    assert c.get('/3').data == b'3'
+    assert len(app.url_matcher.cache) == 0
+
+
+def test_radix_matcher_agrees_with_werkzeug():
+    from werkzeug.exceptions import HTTPException
+    from werkzeug.routing import Map, Rule
+    from flak.routing import RadixMatcher
+
+    url_map = Map([
+        Rule('/', endpoint='index'),
+        Rule('/a', endpoint='a_get', methods=['GET']),
+        Rule('/a', endpoint='a_post', methods=['POST']),
+        Rule('/<name>', endpoint='name', methods=['DELETE']),
+        Rule('/<int:id>', endpoint='id'),
+        Rule('/<int(min=5):big>/x', endpoint='big'),
+        Rule('/u/<uuid:u>', endpoint='uuid'),
+        Rule('/p/<path:rest>', endpoint='path'),
+        Rule('/p/<path:rest>/edit', endpoint='path_edit'),
+        Rule('/dir/', endpoint='dir'),
+        Rule('/dir', endpoint='dir_noslash'),
+        Rule('/loose/', endpoint='loose', strict_slashes=False),
+        Rule('/loose', endpoint='loose_noslash'),
+        Rule('/file-<id>.json', endpoint='file'),
+        Rule('/f/<float:f>', endpoint='float'),
+        Rule('/r', endpoint='r', redirect_to='/a'),
+        Rule('/sub', endpoint='sub', subdomain='api'),
+    ])
+    matcher = RadixMatcher(url_map, 0)
+
+    def result(f):
+        try:
+            rule, args = f()
+            return rule.endpoint, args
+        except HTTPException as e:
+            return (e.code, getattr(e, 'new_url', None),
+                    sorted(getattr(e, 'valid_methods', None) or ()))
+
+    paths = ['/', '/a', '/a/', '/b', '/42', '/4/x', '/7/x', '/7/x/',
+             '/u/6ba7b810-9dad-11d1-80b4-00c04fd430c8', '/u/x',
+             '/p/a/b', '/p/a/b/edit', '/p/', '/dir', '/dir/',
+             '/loose', '/loose/',
+             '/file-1.json', '/f/1.5', '/r', '/sub', '/a/b/c']
+    for subdomain in '', 'api':
+        for path in paths:
+            for method in 'GET', 'POST', 'DELETE':
+                adapter = url_map.bind('localhost', subdomain=subdomain,
+                                       path_info=path)
+                expected = result(lambda: adapter.match(method=method,
+                                                        return_rule=True))
+                assert result(lambda: matcher.match(adapter, method)) \
+                    == expected, (subdomain, path, method)
+
+
+def test_radix_matcher_in_app():
+    from flak.routing import RadixMatcher
+
+    app = Flak(__name__)
+    app.url_matcher_class = RadixMatcher
+
+    @app.route('/')
+    def index(cx):
+        return 'index'
+
+    @app.route('/user/<int:id>/', methods=['GET', 'POST'])
+    def user(cx, id):
+        return 'user %d' % id
+
+    @app.route('/files/<path:name>')
+    def files(cx, name):
+        return name
+
+    c = app.test_client()
+    assert isinstance(app.url_matcher, RadixMatcher)
+    assert c.get('/').data == b'index'
+    assert c.get('/user/3/').data == b'user 3'
+    assert c.get('/user/3').status_code == RequestRedirect.code
+    assert c.get('/user/x/').status_code == 404
+    rv = c.put('/user/3/')
+    assert rv.status_code == 405
+    assert sorted(rv.allow) == ['GET', 'HEAD', 'OPTIONS', 'POST']
+    assert c.get('/files/a/b.txt').data == b'a/b.txt'
+
+
+def test_add_url_rules():
+    app = Flak(__name__)
+
+    def index(cx):
+        return 'index'
+
+    def item(cx, id):
+        return 'item %d' % id
+
+    app.add_url_rules([
+        ('/', index),
+        ('/item/<int:id>', item),
+        ('/item/<int:id>', item, 'item', {'methods': ['POST']}),
+    ] + [('/page%d' % i, index, 'page%d' % i) for i in range(100)])
+
+    c = app.test_client()
+    assert c.get('/').data == b'index'
+    assert c.post('/item/3').data == b'item 3'
+    assert c.get('/page99').data == b'index'
+    assert app.endpoints['page5'] is index
+
+
+def test_add_url_rules_validates_before_adding():
+    app = Flak(__name__)
+
+    def index(cx):
+        return 'index'
+
+    def other(cx):
+        return 'other'
+
+    with pytest.raises(AssertionError):
+        app.add_url_rules([('/', index), ('/other', other, 'index')])
+    with pytest.raises(TypeError):
+        app.add_url_rules([('/', index), ('/x', other, None,
+                                          {'methods': 'POST'})])
+    with pytest.raises(ValueError):
+        app.add_url_rules([('/', index), ('/o/<int:x>/<int:x>', other)])
+    assert list(app.url_map.iter_rules()) == []
+    assert app.endpoints == {}
+
+    app.add_url_rule('/', index)
+    with pytest.raises(AssertionError):
+        app.add_url_rules([('/other', other, 'index')])
+    with pytest.raises(ValueError):
+        app.add_url_rules([('/index', index),
+                           ('/o/<int:x>/<int:x>', other)])
+    assert [r.rule for r in app.url_map.iter_rules()] == ['/']
+    assert [r.rule for r in app.url_map.iter_rules('index')] == ['/']
+    assert 'other' not in app.url_map._rules_by_endpoint
+    assert list(app.endpoints) == ['index']
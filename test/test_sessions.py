@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+
+import time
+import uuid
+import pytest
+from datetime import datetime
+from flak import Flak
+from flak.sessions import (ServerSideSessionInterface, MemorySessionStore,
+                           SqliteSessionStore, FileSessionStore)
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'file'])
+def store(request, tmpdir):
+    if request.param == 'memory':
+        return MemorySessionStore(100)
+    if request.param == 'sqlite':
+        return SqliteSessionStore(str(tmpdir.join('sessions.db')))
+    return FileSessionStore(str(tmpdir.join('sessions')))
+
+
+def make_app(store):
+    app = Flak(__name__)
+    app.secret_key = 'testkey'
+    app.session_interface = ServerSideSessionInterface(store)
+
+    @app.route('/set/<value>')
+    def set(cx, value):
+        cx.session['value'] = value
+        cx.session['items'] = (1, 2)
+        return 'set'
+
+    @app.route('/get')
+    def get(cx):
+        return '%s %s' % (cx.session.get('value'), cx.session.get('items'))
+
+    @app.route('/clear')
+    def clear(cx):
+        cx.session.clear()
+        return 'cleared'
+
+    @app.route('/noop')
+    def noop(cx):
+        return 'noop'
+
+    return app
+
+
+def test_store_roundtrip(store):
+    assert store.load('a') is None
+    store.save('a', u'{"x":1}', 60)
+    assert store.load('a') == u'{"x":1}'
+    store.save('a', u'{"x":2}', 60)
+    assert store.load('a') == u'{"x":2}'
+    store.touch('a', 60)
+    assert store.load('a') == u'{"x":2}'
+    store.delete('a')
+    assert store.load('a') is None
+    store.save('b', u'{}', -1)
+    assert store.load('b') is None
+
+
+def test_server_side_session(store):
+    app = make_app(store)
+    c = app.test_client()
+    rv = c.get('/set/secret')
+    cookie = rv.headers['set-cookie']
+    # only the signed id goes into the cookie
+    assert 'secret' not in cookie
+    assert c.get('/get').data == b'secret (1, 2)'
+    assert 'set-cookie' not in c.get('/noop').headers
+
+    sid = cookie.split('=', 1)[1].split('.', 1)[0]
+    assert store.load(sid) is not None
+    c.get('/clear')
+    assert store.load(sid) is None
+    assert c.get('/get').data == b'None None'
+
+
+def test_server_side_session_writes_only_when_modified():
+    saved = []
+
+    class Store(MemorySessionStore):
+        def save(self, sid, data, ttl):
+            saved.append(data)
+            MemorySessionStore.save(self, sid, data, ttl)
+
+    app = make_app(Store())
+    c = app.test_client()
+    c.get('/set/a')
+    c.get('/get')
+    c.get('/set/a')
+    assert len(saved) == 1
+    c.get('/set/b')
+    assert len(saved) == 2
+
+
+def test_server_side_session_rejects_bad_cookies(store):
+    app = make_app(store)
+    c = app.test_client()
+    c.get('/set/42')
+    c.set_cookie('localhost', 'session', 'forged')
+    assert c.get('/get').data == b'None None'
+
+
+def test_server_side_session_expires(store, monkeypatch):
+    app = make_app(store)
+    app.config['PERMANENT_SESSION_LIFETIME'] = 60
+    c = app.test_client()
+    c.get('/set/42')
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 120)
+    assert c.get('/get').data == b'None None'
+
+
+def make_compact_app():
+    from flak.sessions import (SecureCookieSessionInterface,
+                               CompactSessionSerializer)
+
+    class Interface(SecureCookieSessionInterface):
+        serializer = CompactSessionSerializer
+
+    app = Flak(__name__)
+    app.secret_key = 'testkey'
+    app.session_interface = Interface()
+    return app
+
+
+def test_compact_serializer_roundtrip():
+    from flak.sessions import CompactSessionSerializer
+    from flak._compat import text_type
+    from itsdangerous import BadPayload
+
+    app = make_compact_app()
+    s = CompactSessionSerializer(app)
+    value = {
+        u'text': u'ünicøde', u'ints': [0, -1, 300, -2 ** 70, 2 ** 64],
+        u'float': 1.5, u'flags': (True, False, None),
+        u'bytes': b'\x00\xff', u'uuid': uuid.uuid4(),
+        u'when': datetime(2016, 1, 2, 3, 4, 5, 6),
+        u'nested': {u'a': [{u'b': ()}]},
+    }
+    assert s.loads(s.dumps(value)) == value
+
+    class Markup(object):
+        def __html__(self):
+            return u'<b>'
+
+    assert s.loads(s.dumps(Markup())) == u'<b>'
+    assert isinstance(s.loads(s.dumps(Markup())), text_type)
+    with pytest.raises(TypeError):
+        s.dumps({u'x': object()})
+    with pytest.raises(BadPayload):
+        s.loads(b'\x01d\x05')
+
+
+def test_compact_serializer_reads_json_cookies():
+    from flak.sessions import SecureCookieSessionInterface
+
+    app = make_compact_app()
+
+    @app.route('/set')
+    def set(cx):
+        cx.session['value'] = (1, b'x')
+        return 'set'
+
+    @app.route('/get')
+    def get(cx):
+        return repr(cx.session['value'] == (1, b'x'))
+
+    json_interface = SecureCookieSessionInterface()
+    compact_interface = app.session_interface
+    c = app.test_client()
+    app.session_interface = json_interface
+    c.get('/set')
+    app.session_interface = compact_interface
+    assert c.get('/get').data == b'True'
+
+
+def test_compact_serializer_compresses_large_payloads():
+    app = make_compact_app()
+
+    @app.route('/<int:n>')
+    def set(cx, n):
+        cx.session['items'] = [u'item'] * n
+        return 'set'
+
+    c = app.test_client()
+    small = c.get('/2').headers['set-cookie']
+    assert not small.split('~', 1)[1].startswith('.')
+    large = c.get('/500').headers['set-cookie']
+    assert large.split('~', 1)[1].startswith('.')
+    assert len(large) < 200
+
+
+class _Markup(object):
+    def __html__(self):
+        return u'<b>x</b>'
+
+
+# written by the serializer before tagging moved to a dispatch table, the
+# format must not change or existing cookies become unreadable
+_tagged_json_corpus = [
+    ({}, '{}'),
+    ({u'a': 1, u'b': u'\xfc', u'c': None, u'd': True, u'e': 1.5},
+     '{"a":1,"b":"\\u00fc","c":null,"d":true,"e":1.5}'),
+    ({u'list': [1, [2, [3]]], u'nested': {u'x': {u'y': {}}}},
+     '{"list":[1,[2,[3]]],"nested":{"x":{"y":{}}}}'),
+    ({u't': (1, (2, u'x'), [3])},
+     '{"t":{" t":[1,{" t":[2,"x"]},[3]]}}'),
+    ({u'b': b'\x00\xffabc'}, '{"b":{" b":"AP9hYmM="}}'),
+    ({u'u': uuid.UUID('6ba7b810-9dad-11d1-80b4-00c04fd430c8')},
+     '{"u":{" u":"6ba7b8109dad11d180b400c04fd430c8"}}'),
+    ({u'd': datetime(2016, 1, 2, 3, 4, 5)},
+     '{"d":{" d":"Sat, 02 Jan 2016 03:04:05 GMT"}}'),
+    ({u'mixed': [{u'k': (b'x',)}, (uuid.UUID(int=1),)]},
+     '{"mixed":[{"k":{" t":[{" b":"eA=="}]}},'
+     '{" t":[{" u":"00000000000000000000000000000001"}]}]}'),
+    ({u' b': u'looks tagged', u'other': 1},
+     '{" b":"looks tagged","other":1}'),
+]
+
+
+def test_tagged_json_wire_format():
+    from flak.sessions import TaggedJsonSerializer
+
+    s = TaggedJsonSerializer(Flak(__name__))
+    for value, wire in _tagged_json_corpus:
+        assert s.dumps(value) == wire
+        assert s.loads(wire) == value
+    # markup is written as text and read back as the tagged object
+    assert s.dumps({u'm': _Markup()}) == '{"m":{" m":"<b>x</b>"}}'
+    assert s.loads('{"m":{" m":"<b>x</b>"}}') == {u'm': {u' m': u'<b>x</b>'}}
+
+
+def test_tagging_does_not_copy_plain_data():
+    from flak.sessions import _tag
+
+    plain = {u'a': [1, {u'b': u'c'}], u'd': {u'e': None}}
+    assert _tag(plain) is plain
+    mixed = {u'a': [1, (2,)], u'd': {u'e': None}}
+    tagged = _tag(mixed)
+    assert tagged[u'a'] == [1, {' t': [2]}]
+    assert tagged[u'd'] is mixed[u'd']
+    assert mixed[u'a'] == [1, (2,)]
+
+
+def test_secret_key_rotation():
+    app = Flak(__name__)
+    app.secret_key = 'old'
+
+    @app.route('/set')
+    def set(cx):
+        cx.session['value'] = 42
+        return 'set'
+
+    @app.route('/get')
+    def get(cx):
+        return str(cx.session.get('value'))
+
+    interface = app.session_interface
+    c = app.test_client()
+    cookie = c.get('/set').headers['set-cookie']
+    assert cookie.startswith('session=%s~' % interface.get_key_id('old'))
+
+    app.config['SECRET_KEY'] = 'new'
+    app.config['SECRET_KEY_FALLBACKS'] = ['old']
+    # read with the old key and signed again with the new one
+    rv = c.get('/get')
+    assert rv.data == b'42'
+    cookie = rv.headers['set-cookie']
+    assert cookie.startswith('session=%s~' % interface.get_key_id('new'))
+
+    app.config['SECRET_KEY_FALLBACKS'] = []
+    assert c.get('/get').data == b'42'
+    app.config['SECRET_KEY'] = 'newer'
+    assert c.get('/get').data == b'None'
+
+
+def test_secret_key_rotation_verifies_with_the_indicated_key():
+    from flak.sessions import SecureCookieSessionInterface
+
+    tried = []
+
+    class Interface(SecureCookieSessionInterface):
+        def make_signing_serializer(self, app, secret_key=None):
+            s = SecureCookieSessionInterface.make_signing_serializer(
+                self, app, secret_key)
+            loads = s.loads
+
+            def recording_loads(*args, **kwargs):
+                tried.append(secret_key)
+                return loads(*args, **kwargs)
+            s.loads = recording_loads
+            return s
+
+    app = Flak(__name__)
+    app.session_interface = Interface()
+    app.config['SECRET_KEY'] = 'c'
+    app.config['SECRET_KEY_FALLBACKS'] = ['b', 'a']
+
+    @app.route('/set')
+    def set(cx):
+        cx.session['value'] = 42
+        return 'set'
+
+    @app.route('/get')
+    def get(cx):
+        return str(cx.session.get('value'))
+
+    c = app.test_client()
+    app.config['SECRET_KEY'] = 'a'
+    app.config['SECRET_KEY_FALLBACKS'] = []
+    c.get('/set')
+
+    app.config['SECRET_KEY'] = 'c'
+    app.config['SECRET_KEY_FALLBACKS'] = ['b', 'a']
+    del tried[:]
+    assert c.get('/get').data == b'42'
+    assert tried == ['a']
+    del tried[:]
+    assert c.get('/get').data == b'42'
+    assert tried == ['c']
+
+    # cookies from before key ids try every key, newest first
+    legacy = app.session_interface.make_signing_serializer(app, 'a')
+    c.set_cookie('localhost', 'session', legacy.dumps({'value': 1}))
+    del tried[:]
+    assert c.get('/get').data == b'1'
+    assert tried == ['c', 'b', 'a']
+
+
+def test_precomputed_hmac_matches_itsdangerous():
+    import hashlib
+    from itsdangerous import HMACAlgorithm
+    from flak.sessions import PrecomputedHMACAlgorithm
+
+    for digest in hashlib.sha1, hashlib.sha256:
+        algorithm = PrecomputedHMACAlgorithm(digest)
+        for key in b'k', b'other key':
+            for value in b'', b'value', b'value' * 100:
+                assert algorithm.get_signature(key, value) == \
+                    HMACAlgorithm(digest).get_signature(key, value)
+                assert algorithm.verify_signature(
+                    key, value, algorithm.get_signature(key, value))
+
+
+@pytest.mark.parametrize('name', ['hmac', 'blake2b'])
+def test_session_signer_algorithms(name):
+    import hashlib
+    from flak.sessions import (SecureCookieSessionInterface,
+                               PrecomputedHMACAlgorithm, Blake2bAlgorithm)
+
+    if name == 'blake2b':
+        if not hasattr(hashlib, 'blake2b'):
+            pytest.skip('hashlib.blake2b is not available')
+        algorithm = Blake2bAlgorithm()
+    else:
+        algorithm = PrecomputedHMACAlgorithm()
+
+    class Interface(SecureCookieSessionInterface):
+        signer_algorithm = algorithm
+
+    app = Flak(__name__)
+    app.secret_key = 'testkey'
+    app.session_interface = Interface()
+
+    @app.route('/set')
+    def set(cx):
+        cx.session['value'] = 42
+        return 'set'
+
+    @app.route('/get')
+    def get(cx):
+        return str(cx.session.get('value'))
+
+    c = app.test_client()
+    c.get('/set')
+    assert c.get('/get').data == b'42'
+    app.session_interface = SecureCookieSessionInterface()
+    expected = b'42' if name == 'hmac' else b'None'
+    assert c.get('/get').data == expected
+
+
+def test_session_cookie_template():
+    from werkzeug.wrappers import Response
+    from flak.sessions import SessionInterface
+
+    app = Flak(__name__)
+    app.config.update(SERVER_NAME='example.com:8080',
+                      SESSION_COOKIE_SECURE=True)
+    interface = SessionInterface()
+    expires = datetime(2030, 1, 2, 3, 4, 5)
+    for exp in None, expires:
+        expected, actual = Response(), Response()
+        expected.set_cookie('session', 'a.b~c-d_e', expires=exp,
+                            domain='.example.com', secure=True,
+                            httponly=True)
+        interface.get_cookie_template(app).set_cookie(actual, 'a.b~c-d_e',
+                                                      exp)
+        assert actual.headers.getlist('Set-Cookie') == \
+            expected.headers.getlist('Set-Cookie')
+
+    template = interface.get_cookie_template(app)
+    assert interface.get_cookie_template(app) is template
+    app.config['SESSION_COOKIE_PATH'] = '/app'
+    template = interface.get_cookie_template(app)
+    assert template.path == '/app'
+    response = Response()
+    template.set_cookie(response, 'value')
+    assert 'Path=/app' in response.headers['Set-Cookie']
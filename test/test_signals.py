@@ -118,3 +118,37 @@ def test_teardown_signals():
     finally:
         flak.context_teardown.disconnect(record_teardown, app)
 
+
+def test_has_receivers_flag():
+    app = flak.Flak(__name__)
+    signal = flak.request_started
+    assert not signal.has_receivers
+
+    def record(sender, **kw):
+        pass
+
+    signal.connect(record, app)
+    assert signal.has_receivers
+    signal.disconnect(record, app)
+    assert not signal.has_receivers
+
+    signal.connect(record)
+    assert signal.has_receivers
+    signal.disconnect(record)
+    assert not signal.has_receivers
+
+
+def test_signals_skipped_without_receivers(monkeypatch):
+    app = flak.Flak(__name__)
+
+    @app.route('/')
+    def index(cx):
+        return 'Hello'
+
+    def fail(*args, **kwargs):
+        raise AssertionError('signal sent without receivers')
+
+    for signal in (flak.context_created, flak.request_started,
+                   flak.request_finished, flak.context_teardown):
+        monkeypatch.setattr(signal, 'send', fail)
+    assert app.test_client().get('/').data == b'Hello'
@@ -111,3 +111,33 @@ def test_error_handler_http_subclass():
     assert c.get('/forbidden-registered').data == b'forbidden-registered'
 
 
+def test_error_handler_resolution_is_cached():
+    app = Flak(__name__)
+
+    class ParentException(Exception):
+        pass
+
+    class ChildException(ParentException):
+        pass
+
+    @app.errorhandler(ParentException)
+    def parent_exception_handler(cx, e):
+        return 'parent'
+
+    assert app._find_error_handler(ChildException()) is \
+        parent_exception_handler
+    assert app._find_error_handler(KeyError()) is None
+    assert app.error_handlers == {None: {ParentException:
+                                         parent_exception_handler}}
+
+    @app.errorhandler(ChildException)
+    def child_exception_handler(cx, e):
+        return 'child'
+
+    @app.errorhandler(500)
+    def handle_500(cx, e):
+        return 'error'
+
+    assert app._find_error_handler(ChildException()) is \
+        child_exception_handler
+    assert app._find_error_handler(InternalServerError()) is handle_500